@@ -0,0 +1,78 @@
+-- Cold storage for the games older than the archive cutoff, attached to the live database as
+-- "archive". Every game is in exactly one of the two files together with its roles, points
+-- events and daily rollups, players and ratings stay in the live database
+
+PRAGMA journal_mode = WAL;
+
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    winner_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS roles (
+    id INTEGER PRIMARY KEY,
+    game_id INTEGER NOT NULL,
+    player_id INTEGER NOT NULL,
+    role text NOT NULL,
+    point_delta INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS points_events (
+    id INTEGER PRIMARY KEY,
+    role_id INTEGER NOT NULL,
+    event_type text NOT NULL,
+    points INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS roles_game_id ON roles(game_id);
+CREATE INDEX IF NOT EXISTS roles_player_id ON roles(player_id);
+CREATE INDEX IF NOT EXISTS points_events_role_id ON points_events(role_id);
+CREATE INDEX IF NOT EXISTS games_created_at ON games(created_at);
+
+-- Daily rollups of the archived days, same columns as the live player_daily_stats
+CREATE TABLE IF NOT EXISTS player_daily_stats (
+    day text NOT NULL,
+    player_id INTEGER NOT NULL,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    win_points INTEGER NOT NULL,
+    max_win INTEGER,
+    losses INTEGER NOT NULL,
+    loss_points INTEGER NOT NULL,
+    max_loss INTEGER,
+    seller_games INTEGER NOT NULL,
+    sells INTEGER NOT NULL,
+    sell_points INTEGER NOT NULL,
+    max_sell INTEGER,
+    frls INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    dealer_games INTEGER NOT NULL,
+    dealer_wins INTEGER NOT NULL,
+    PRIMARY KEY (day, player_id)
+);
+
+-- All time per player stats parts of the archived games, summed with the live parts by /stats
+CREATE TABLE IF NOT EXISTS archive_player_stats (
+    player_id INTEGER PRIMARY KEY,
+    games INTEGER NOT NULL,
+    win_events INTEGER NOT NULL,
+    win_delta INTEGER NOT NULL,
+    won_games INTEGER NOT NULL,
+    max_win INTEGER,
+    loss_delta INTEGER NOT NULL,
+    loss_events INTEGER NOT NULL,
+    max_loss INTEGER,
+    sell_points INTEGER NOT NULL,
+    seller_rows INTEGER NOT NULL,
+    max_sell INTEGER
+);
+
+-- Totals of the whole archive and the cutoff every archived game was created before
+CREATE TABLE IF NOT EXISTS archive_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    cutoff text NOT NULL,
+    games INTEGER NOT NULL,
+    dealer_games INTEGER NOT NULL,
+    dealer_wins INTEGER NOT NULL
+);
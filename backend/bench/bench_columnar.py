@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROLES_PER_GAME = 4
+
+# Row paths read the player over time query with fetchall into dicts the way the analytics
+# routes did before the columnar fetch, columnar paths are the current code. The old svg path
+# needs pandas, which the backend itself no longer requires
+CASES = ("rows-timeseries", "columnar-timeseries", "rows-svg", "columnar-svg")
+
+def build_database(path, games, players, seed=1):
+    """
+    Create a database of games with ROLES_PER_GAME roles each, written with plain inserts since
+    only the shape and size of the roles table matter here
+    """
+    os.environ["DATABASE_PATH"] = path
+    sys.path.insert(0, BACKEND_DIR)
+    from gostop_database import GostopDB
+
+    gostop_db = GostopDB(pooled=False)
+    gostop_db.create_database()
+    con = gostop_db.db_con
+    rng = random.Random(seed)
+
+    con.executemany(''' INSERT INTO players(balance, name, username) VALUES (0, ?, ?) ''',
+                    [(f"Player {i}", f"player{i}") for i in range(players)])
+    player_ids = [row[0] for row in con.execute(''' SELECT id FROM players ''')]
+
+    role_id = 0
+    for game_id in range(1, games + 1):
+        seated = rng.sample(player_ids, ROLES_PER_GAME)
+        con.execute(''' INSERT INTO games(id, winner_id, created_at) VALUES (?, ?, datetime(?, 'unixepoch')) ''',
+                    (game_id, seated[0], 1600000000 + game_id * 60))
+
+        roles = []
+        for i, player_id in enumerate(seated):
+            role_id += 1
+            delta = rng.randint(3, 40) if i == 0 else -rng.randint(1, 20)
+            roles.append((role_id, game_id, player_id, "DEALER" if i == 1 else "PLAYER", delta))
+        con.executemany(''' INSERT INTO roles(id, game_id, player_id, role, point_delta) VALUES (?, ?, ?, ?, ?) ''', roles)
+
+    con.commit()
+    gostop_db.close()
+
+def rows_over_time(gostop_db):
+    """
+    The player over time read as it was before the columnar fetch, every row kept as a dict
+    """
+    cmd = '''
+        SELECT player_id, player_name, game_id, point_delta
+        FROM ( ''' + gostop_db._each_schema('''
+            SELECT
+                r.player_id AS player_id,
+                p.name AS player_name,
+                g.id AS game_id,
+                r.point_delta,
+                g.created_at
+            FROM {schema}.roles r
+            JOIN {schema}.games g ON r.game_id = g.id
+            JOIN players p ON r.player_id = p.id ''') + '''
+        )
+        ORDER BY created_at
+        '''
+
+    return [dict(r) for r in gostop_db.db_con.execute(cmd).fetchall()]
+
+def run_case(case):
+    """
+    Run one case against DATABASE_PATH, returns its seconds and the peak RSS it added on top of
+    the imports
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    import numpy as np
+    from gostop_database import GostopDB
+    from gostop_timeseries import build_player_timeseries, player_cumulative, DEFAULT_POINTS
+
+    if case.startswith("rows-"):
+        import pandas as pd
+
+    gostop_db = GostopDB(pooled=False)
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+
+    if case == "rows-timeseries":
+        rows = rows_over_time(gostop_db)
+        columns = {name: np.fromiter((r[name] for r in rows), dtype=np.int64, count=len(rows))
+                   for name in ("player_id", "game_id", "point_delta")}
+        names = {}
+        for r in rows:
+            names.setdefault(r["player_id"], r["player_name"])
+        result = len(build_player_timeseries(columns, names, DEFAULT_POINTS)["players"])
+    elif case == "columnar-timeseries":
+        result = len(build_player_timeseries(gostop_db._get_player_over_time(), gostop_db._get_player_names(),
+                                             DEFAULT_POINTS)["players"])
+    elif case == "rows-svg":
+        df = pd.DataFrame(rows_over_time(gostop_db))
+        df = df.sort_values("game_id").reset_index(drop=True)
+        id_mapping = {old_id: new_id for new_id, old_id in enumerate(df["game_id"].unique())}
+        df["normalized_game_id"] = df["game_id"].map(id_mapping)
+        result = 0
+        for player_id, group in df.groupby("player_id"):
+            group = group.sort_values("normalized_game_id")
+            group["cumulative_points"] = group["point_delta"].cumsum()
+            result += 1
+    elif case == "columnar-svg":
+        names = gostop_db._get_player_names()
+        result = sum(1 for player_id, x, y in player_cumulative(gostop_db._get_player_over_time()) if player_id in names)
+    else:
+        raise ValueError(f"Unknown case {case}")
+
+    seconds = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    gostop_db.close()
+
+    return {"case": case, "seconds": round(seconds, 4), "peak_rss_mb": round((peak_kb - base_kb) / 1024, 1),
+            "players": result}
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and measure the player over time reads, row dicts against columns")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "gostop_bench_columnar.db"),
+                        help="benchmark database, built first when it does not exist")
+    parser.add_argument("--games", type=int, default=100000, help="games to build, each has 4 roles")
+    parser.add_argument("--players", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the fastest is reported")
+    parser.add_argument("--case", choices=CASES, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_PATH"] = args.db
+
+    # Each case runs in a fresh process so the peak RSS of one does not hide the next
+    if args.case is not None:
+        print(json.dumps(run_case(args.case)))
+        return
+
+    if not os.path.exists(args.db):
+        start = time.perf_counter()
+        build_database(args.db, args.games, args.players)
+        print(f"Built {args.db} with {args.games} games in {time.perf_counter() - start:.1f}s")
+
+    con = sqlite3.connect(args.db)
+    print(f"{con.execute('SELECT COUNT(*) FROM roles').fetchone()[0]} role rows")
+    con.close()
+
+    print(f"{'case':<22} {'seconds':>8} {'peak rss MB':>12}")
+    for case in CASES:
+        runs = []
+        for _ in range(args.repeat):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--db", args.db, "--case", case],
+                                 capture_output=True, text=True)
+            if out.returncode != 0:
+                runs = None
+                print(f"{case:<22} failed: {out.stderr.strip().splitlines()[-1]}")
+                break
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+        if runs:
+            best = min(runs, key=lambda r: r["seconds"])
+            print(f"{case:<22} {best['seconds']:>8} {max(r['peak_rss_mb'] for r in runs):>12}")
+
+if __name__ == "__main__":
+    main()
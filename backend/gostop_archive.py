@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timedelta, timezone
+import argparse
+import json
+import os
+import time
+
+from gostop_database import GostopDB
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+# Games older than this many days are moved into the archive by default
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+
+def archive(before_day, league=None, vacuum=False):
+    """
+    Move the games created before the UTC day before_day into the league's archive database,
+    returns what was moved and how long it took
+    """
+    before = datetime.fromisoformat(before_day).date()
+    if before > datetime.now(timezone.utc).date():
+        raise ValueError("Only days in the past can be archived")
+
+    start = time.perf_counter()
+
+    gostop_db = GostopDB(league=league, pooled=False)
+    try:
+        report = gostop_db._archive_games(before.isoformat())
+
+        # Hand the freed pages back so the live file actually shrinks
+        if vacuum:
+            gostop_db.db_con.execute("VACUUM main")
+            gostop_db.db_con.execute("VACUUM archive")
+
+        report["archive_path"] = gostop_db.archive_path
+        report["live_bytes"] = os.path.getsize(gostop_db.path)
+        report["archive_bytes"] = os.path.getsize(gostop_db.archive_path)
+    finally:
+        gostop_db.close()
+
+    report["seconds"] = round(time.perf_counter() - start, 4)
+    return report
+
+def status(league=None):
+    """
+    Get the archive cutoff and totals of a league
+    """
+    gostop_db = GostopDB(league=league, pooled=False)
+    try:
+        totals = gostop_db._get_archive_totals()
+        live_games = gostop_db._get_num_games()
+    finally:
+        gostop_db.close()
+
+    return {"archive": totals, "total_games": live_games[0].get("total_games") if live_games else 0}
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old games into the cold storage archive")
+    parser.add_argument("--league", default=None, help="league to archive, the default database when omitted")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = subparsers.add_parser("archive", help="archive the games created before a day")
+    archive_parser.add_argument("--before", help="UTC day, YYYY-MM-DD")
+    archive_parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                                help="archive games older than this many days when --before is not given")
+    archive_parser.add_argument("--vacuum", action="store_true", help="compact both files afterwards")
+
+    subparsers.add_parser("status", help="show the archive cutoff and totals")
+
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        before = args.before or (datetime.now(timezone.utc).date() - timedelta(days=args.days)).isoformat()
+        print(json.dumps(archive(before, args.league, args.vacuum), indent=2))
+    elif args.command == "status":
+        print(json.dumps(status(args.league), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+from datetime import datetime, timezone
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from gostop_database import DEFAULT_DB, archive_db_path, league_db_path, list_leagues
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+BACKUP_DIR = os.getenv("BACKUP_DIR")
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "0"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+
+# Pages copied per step, sleeping between steps leaves the disk to live traffic
+STEP_PAGES = 256
+STEP_SLEEP = 0.005
+
+SNAPSHOT_PREFIX = "gostop-"
+SNAPSHOT_SUFFIX = ".db"
+
+def file_sha256(path):
+    """
+    Get the hex sha256 of a file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def copy_database(src_con, dst_con, pages=STEP_PAGES, sleep=STEP_SLEEP):
+    """
+    Copy one database into another with the online backup API in small page steps, returns
+    the number of steps and pages copied
+
+    The source read transaction is held across the steps, with the WAL journal this pins a
+    point in time snapshot so concurrent writers neither block nor restart the copy
+    """
+    progress = {"steps": 0, "pages": 0}
+
+    def on_progress(status, remaining, total):
+        progress["steps"] += 1
+        progress["pages"] = total
+
+    src_con.execute("BEGIN")
+    src_con.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    try:
+        src_con.backup(dst_con, pages=pages, progress=on_progress, sleep=sleep)
+    finally:
+        src_con.execute("COMMIT")
+
+    return progress
+
+def list_snapshots(backup_dir):
+    """
+    Get the snapshot paths in a backup directory, oldest first
+    """
+    if not os.path.isdir(backup_dir):
+        return []
+
+    names = [n for n in os.listdir(backup_dir) if n.startswith(SNAPSHOT_PREFIX) and n.endswith(SNAPSHOT_SUFFIX)]
+    return [os.path.join(backup_dir, n) for n in sorted(names)]
+
+def rotate_snapshots(backup_dir, keep):
+    """
+    Delete all but the newest keep snapshots and their checksums, returns the deleted paths
+    """
+    snapshots = list_snapshots(backup_dir)
+    expired = snapshots[:-keep] if keep > 0 else []
+
+    for path in expired:
+        os.remove(path)
+        if os.path.exists(path + ".sha256"):
+            os.remove(path + ".sha256")
+
+    return expired
+
+def backup(db_path=DEFAULT_DB, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP, pages=STEP_PAGES, sleep=STEP_SLEEP):
+    """
+    Take a checksummed point in time snapshot of the database without blocking writers and
+    rotate the old ones out, returns a timing and throughput report
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    path = os.path.join(backup_dir, SNAPSHOT_PREFIX + stamp + SNAPSHOT_SUFFIX)
+    tmp_path = path + ".tmp"
+
+    start = time.perf_counter()
+
+    src_con = sqlite3.connect(db_path, isolation_level=None)
+    dst_con = sqlite3.connect(tmp_path)
+    try:
+        progress = copy_database(src_con, dst_con, pages=pages, sleep=sleep)
+
+        # Snapshots are single self contained files
+        dst_con.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        dst_con.close()
+        src_con.close()
+
+    copy_seconds = time.perf_counter() - start
+
+    sha256 = file_sha256(tmp_path)
+    os.replace(tmp_path, path)
+    with open(path + ".sha256", "w") as f:
+        f.write(f"{sha256}  {os.path.basename(path)}\n")
+
+    expired = rotate_snapshots(backup_dir, keep)
+
+    seconds = time.perf_counter() - start
+    size = os.path.getsize(path)
+
+    return {
+        "db": db_path,
+        "path": path,
+        "sha256": sha256,
+        "bytes": size,
+        "pages": progress["pages"],
+        "steps": progress["steps"],
+        "copy_seconds": round(copy_seconds, 4),
+        "seconds": round(seconds, 4),
+        "mb_per_second": round(size / (1 << 20) / copy_seconds, 2) if copy_seconds > 0 else None,
+        "rotated": expired,
+    }
+
+def backup_targets(db_path=DEFAULT_DB):
+    """
+    Get every database a full backup covers, the default database, each league database in
+    LEAGUE_DIR and their archives, paired with the subdirectory their snapshots go to
+    """
+    targets = [(db_path, "")]
+    for league in list_leagues():
+        targets.append((league_db_path(league), os.path.join("leagues", league)))
+
+    for path, subdir in list(targets):
+        if os.path.exists(archive_db_path(path)):
+            targets.append((archive_db_path(path), os.path.join(subdir, "archive")))
+
+    return targets
+
+def backup_all(db_path=DEFAULT_DB, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP, pages=STEP_PAGES, sleep=STEP_SLEEP):
+    """
+    Back up every database of backup_targets, the default one into backup_dir itself and the
+    others into subdirectories with their own rotation, returns a report per database
+    """
+    reports = []
+    for path, subdir in backup_targets(db_path):
+        try:
+            reports.append(backup(path, os.path.join(backup_dir, subdir), keep, pages, sleep))
+        except Exception as e:
+            # One broken league must not stop the others from being backed up
+            reports.append({"db": path, "error": str(e)})
+
+    return reports
+
+def verify(path):
+    """
+    Check a snapshot against its stored checksum and run an integrity check on it
+    """
+    with open(path + ".sha256", "r") as f:
+        expected = f.read().split()[0]
+
+    if file_sha256(path) != expected:
+        return False
+
+    con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return con.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    finally:
+        con.close()
+
+def restore(path, db_path=DEFAULT_DB, pages=STEP_PAGES, sleep=STEP_SLEEP):
+    """
+    Restore a verified snapshot over the database, open connections see the restored data on
+    their next transaction
+    """
+    if not verify(path):
+        raise ValueError(f"Snapshot {path} failed verification")
+
+    start = time.perf_counter()
+
+    src_con = sqlite3.connect(f"file:{path}?mode=ro", uri=True, isolation_level=None)
+    dst_con = sqlite3.connect(db_path)
+    try:
+        progress = copy_database(src_con, dst_con, pages=pages, sleep=sleep)
+    finally:
+        dst_con.close()
+        src_con.close()
+
+    return {"path": path, "pages": progress["pages"], "steps": progress["steps"],
+            "seconds": round(time.perf_counter() - start, 4)}
+
+def run_schedule(db_path, backup_dir, interval, keep, stop_event=None):
+    """
+    Back up every database every interval seconds until stop_event is set, leagues created
+    after the schedule started are picked up on the next run
+    """
+    stop_event = stop_event or threading.Event()
+    while not stop_event.wait(interval):
+        for report in backup_all(db_path, backup_dir, keep):
+            if "error" in report:
+                print("Backup error:", report["db"], report["error"])
+            else:
+                print("Backup:", json.dumps(report))
+
+def start_backup_scheduler(db_path=DEFAULT_DB, backup_dir=BACKUP_DIR, interval=BACKUP_INTERVAL, keep=BACKUP_KEEP):
+    """
+    Run the backup schedule on a daemon thread, only one process per backup directory gets
+    the scheduler lock so multiple gunicorn workers do not all take snapshots
+    """
+    if not backup_dir or interval <= 0:
+        return None
+
+    os.makedirs(backup_dir, exist_ok=True)
+    lock_file = open(os.path.join(backup_dir, ".scheduler.lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+
+    thread = threading.Thread(target=run_schedule, args=(db_path, backup_dir, interval, keep), daemon=True)
+    # Keep the lock held for the life of the thread
+    thread.lock_file = lock_file
+    thread.start()
+
+    return thread
+
+def main():
+    parser = argparse.ArgumentParser(description="Online backups of the gostop database")
+    parser.add_argument("--db", default=DEFAULT_DB, help="database to back up or restore into")
+    parser.add_argument("--dir", default=BACKUP_DIR, help="snapshot directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backup_parser = subparsers.add_parser("backup", help="take a snapshot now")
+    backup_parser.add_argument("--keep", type=int, default=BACKUP_KEEP)
+    backup_parser.add_argument("--pages", type=int, default=STEP_PAGES)
+    backup_parser.add_argument("--all", action="store_true",
+                               help="also back up every league database and the archives")
+
+    schedule_parser = subparsers.add_parser("schedule", help="take a snapshot every interval seconds")
+    schedule_parser.add_argument("--interval", type=int, default=BACKUP_INTERVAL or 3600)
+    schedule_parser.add_argument("--keep", type=int, default=BACKUP_KEEP)
+
+    subparsers.add_parser("list", help="list snapshots")
+
+    verify_parser = subparsers.add_parser("verify", help="verify a snapshot")
+    verify_parser.add_argument("snapshot")
+
+    restore_parser = subparsers.add_parser("restore", help="restore a snapshot over the database")
+    restore_parser.add_argument("snapshot")
+
+    args = parser.parse_args()
+
+    if args.command in ("backup", "schedule", "list") and not args.dir:
+        parser.error("--dir or BACKUP_DIR is required")
+
+    if args.command == "backup":
+        if args.all:
+            print(json.dumps(backup_all(args.db, args.dir, args.keep, args.pages), indent=2))
+        else:
+            print(json.dumps(backup(args.db, args.dir, args.keep, args.pages), indent=2))
+    elif args.command == "schedule":
+        run_schedule(args.db, args.dir, args.interval, args.keep)
+    elif args.command == "list":
+        for path in list_snapshots(args.dir):
+            print(path, os.path.getsize(path))
+    elif args.command == "verify":
+        ok = verify(args.snapshot)
+        print("ok" if ok else "FAILED")
+        raise SystemExit(0 if ok else 1)
+    elif args.command == "restore":
+        print(json.dumps(restore(args.snapshot, args.db), indent=2))
+
+if __name__ == "__main__":
+    main()
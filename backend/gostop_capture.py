@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import threading
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+# Requests are appended to requests-<pid>.jsonl in this directory when it is set
+CAPTURE_DIR = os.getenv("CAPTURE_DIR")
+# A worker stops capturing once its log reaches this many bytes
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(100 << 20)))
+
+# The replay logs in by itself, so the credential exchanges are never written down
+SKIPPED_PATHS = ("/login", "/refresh")
+SENSITIVE_KEYS = {"password", "token", "access_token", "refresh_token"}
+REDACTED = "[redacted]"
+
+def sanitize(value):
+    """
+    Replace the values of credential keys anywhere in a JSON body
+    """
+    if isinstance(value, dict):
+        return {k: REDACTED if k.lower() in SENSITIVE_KEYS else sanitize(v) for k, v in value.items()}
+
+    if isinstance(value, list):
+        return [sanitize(v) for v in value]
+
+    return value
+
+class RequestLog():
+    """
+    Append only JSON lines log of the requests a worker served, headers and cookies are never
+    recorded so tokens stay out of it
+    """
+
+    def __init__(self, capture_dir=CAPTURE_DIR, max_bytes=CAPTURE_MAX_BYTES):
+        self.capture_dir = capture_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.pid = None
+        self.written = 0
+
+        if capture_dir:
+            os.makedirs(capture_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.capture_dir)
+
+    def record(self, started_at, seconds, league, method, route, path, args, body, authenticated, status):
+        """
+        Append one served request, started_at is its wall clock start
+        """
+        if path in SKIPPED_PATHS:
+            return
+
+        line = json.dumps({
+            "t": round(started_at, 6),
+            "seconds": round(seconds, 6),
+            "league": league,
+            "method": method,
+            "route": route,
+            "path": path,
+            "args": args,
+            "body": sanitize(body),
+            "auth": authenticated,
+            "status": status,
+        }, separators=(",", ":")) + "\n"
+
+        with self.lock:
+            # Every gunicorn worker writes its own file
+            path = os.path.join(self.capture_dir, f"requests-{os.getpid()}.jsonl")
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.written = os.path.getsize(path) if os.path.exists(path) else 0
+
+            if self.written >= self.max_bytes:
+                return
+
+            with open(path, "a") as f:
+                f.write(line)
+            self.written += len(line)
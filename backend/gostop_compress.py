@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+import gzip
+import hashlib
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+# Bodies smaller than this many bytes are sent as is, compressing them saves next to nothing
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+# Compressed bodies are cached per data version, so a slower but smaller setting pays off
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "9"))
+
+# Bytes of compressed bodies each worker keeps, least recently used ones are dropped first
+COMPRESS_CACHE_BYTES = int(os.getenv("COMPRESS_CACHE_BYTES", str(32 << 20)))
+
+COMPRESSIBLE_TYPES = ("application/json", "image/svg+xml", "text/")
+
+def available_encodings():
+    """
+    Get the content encodings this process can produce, most preferred first
+    """
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+def choose_encoding(accept_encodings):
+    """
+    Pick the preferred encoding the client accepts from a werkzeug Accept header, None when
+    the body should go out uncompressed
+    """
+    for encoding in available_encodings():
+        if accept_encodings[encoding] > 0:
+            return encoding
+
+    return None
+
+def compressible(response):
+    """
+    Check a response is worth compressing, streamed and already encoded bodies are left alone
+    """
+    if response.direct_passthrough or response.is_streamed:
+        return False
+
+    if response.status_code != 200 or "Content-Encoding" in response.headers:
+        return False
+
+    mimetype = response.mimetype or ""
+    if not mimetype.startswith(COMPRESSIBLE_TYPES):
+        return False
+
+    return response.content_length is not None and response.content_length >= COMPRESS_MIN_BYTES
+
+def compress(data, encoding):
+    """
+    Compress data with the given content encoding
+    """
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+
+    # mtime=0 keeps the output the same for the same body
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+class CompressedCache():
+    """
+    Bounded LRU of compressed bodies keyed by encoding and the digest of the plain body. The
+    digest pins the exact bytes, so entries never go stale and need no data version
+    """
+
+    def __init__(self, max_bytes=COMPRESS_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def compress(self, data, encoding):
+        """
+        Get data compressed with encoding, compressing it only on a miss
+        """
+        key = (encoding, hashlib.blake2b(data, digest_size=16).digest())
+
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+                return body
+
+        # Compress outside the lock, two threads missing on the same body both store the same bytes
+        body = compress(data, encoding)
+        if len(body) > self.max_bytes:
+            return body
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = body
+                self.size += len(body)
+
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+        return body
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import sys
+import time
+
+from gostop_database import GostopDB
+
+def check(league=None, full=False):
+    """
+    Check the games and players of a league changed since the last check, or all of them when
+    full is set, store the result and return the report
+    """
+    start = time.perf_counter()
+
+    gostop_db = GostopDB(league=league, pooled=False)
+    try:
+        result = gostop_db._check_consistency(full)
+        gostop_db._save_consistency(result)
+    finally:
+        gostop_db.close()
+
+    return report(result, time.perf_counter() - start)
+
+def report(result, seconds):
+    """
+    Shape a _check_consistency result for printing or sending back
+    """
+    ok = not result["games"] and not result["players"]
+    return {
+        "ok": ok,
+        "status": "consistent" if ok else "inconsistent",
+        "full": result["full"],
+        "watermark": result["watermark"],
+        "checked_games": None if result["game_ids"] is None else len(result["game_ids"]),
+        "checked_players": None if result["player_ids"] is None else len(result["player_ids"]),
+        "games": result["games"],
+        "players": result["players"],
+        "seconds": round(seconds, 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Check point deltas and balances add up")
+    parser.add_argument("--league", default=None, help="league to check, the default database when omitted")
+    parser.add_argument("--full", action="store_true", help="check every game and player, not only the changed ones")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="keep checking every this many seconds instead of once")
+
+    args = parser.parse_args()
+
+    while True:
+        res = check(args.league, args.full)
+        print(json.dumps(res, indent=2), flush=True)
+
+        if args.interval <= 0:
+            sys.exit(0 if res["ok"] else 1)
+
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,649 @@
 #!/usr/bin/env python3
 
-from datetime import datetime
-from zoneinfo import ZoneInfo
+from collections import OrderedDict
+from datetime import datetime, timedelta
 import json
-import sqlite3
 import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from gostop_rating import INITIAL_RATING
+from gostop_json import RawJSON
+from gostop_time import DEFAULT_TIMEZONE, localize_epochs
 
 # =============================================================================
 # Globals.
 # =============================================================================
 
 DEFAULT_DB = os.getenv("DATABASE_PATH", ".data.DEFAULT.db")
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+ARCHIVE_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive_schema.sql")
+
+# Every other league lives in its own <league>.db file in this directory
+LEAGUE_DIR = os.getenv("LEAGUE_DIR")
+LEAGUE_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+# Idle connections kept per league, league databases kept open and seconds before an unused
+# league database is closed
+POOL_SIZE = int(os.getenv("POOL_SIZE", "4"))
+MAX_OPEN_LEAGUES = int(os.getenv("MAX_OPEN_LEAGUES", "32"))
+LEAGUE_IDLE_SECONDS = float(os.getenv("LEAGUE_IDLE_SECONDS", "300"))
+
+# Rows pulled from the cursor at a time by the columnar fetches
+FETCH_CHUNK_ROWS = 8192
+
+# Per day, per player totals over the games created in [start, end) of one schema, shared by the
+# daily rollups and the partial edge days of a date range query
+ROLLUP_SELECT = '''
+    SELECT
+        day,
+        player_id,
+        COUNT(*) AS games,
+        SUM( won ) AS wins,
+        SUM( CASE WHEN won THEN point_delta ELSE 0 END ) AS win_points,
+        MAX( CASE WHEN won THEN point_delta END ) AS max_win,
+        SUM( loss ) AS losses,
+        SUM( CASE WHEN loss THEN point_delta ELSE 0 END ) AS loss_points,
+        MIN( CASE WHEN loss THEN point_delta END ) AS max_loss,
+        SUM( role = 'SELLER' ) AS seller_games,
+        SUM( sell IS NOT NULL ) AS sells,
+        SUM( COALESCE(sell, 0) ) AS sell_points,
+        MAX( sell ) AS max_sell,
+        SUM( frl ) AS frls,
+        SUM( point_delta ) AS points,
+        SUM( role = 'DEALER' ) AS dealer_games,
+        SUM( role = 'DEALER' AND won ) AS dealer_wins
+    FROM (
+        SELECT
+            date(g.created_at) AS day,
+            r.player_id,
+            r.role,
+            r.point_delta,
+            g.winner_id = r.player_id AS won,
+            COALESCE( MAX( pe.event_type = 'LOSS_MULTIPLIER' ), 0 ) AS loss,
+            COALESCE( MAX( pe.event_type = 'FIRST_ROUND_LOCK' ), 0 ) AS frl,
+            MAX( CASE WHEN pe.event_type = 'SELL' THEN pe.points END ) AS sell
+        FROM {schema}.games g
+        JOIN {schema}.roles r ON r.game_id = g.id
+        LEFT JOIN {schema}.points_events pe ON pe.role_id = r.id
+        WHERE g.created_at >= {start} AND g.created_at < {end}
+        GROUP BY r.id
+    )
+    GROUP BY day, player_id
+'''
+
+ROLLUP_COLUMNS = '''day, player_id, games, wins, win_points, max_win, losses, loss_points, max_loss,
+    seller_games, sells, sell_points, max_sell, frls, points, dealer_games, dealer_wins'''
+
+# Per player parts of the all time stats over the games of one schema, the parts of disjoint sets
+# of games add up to the stats of their union. Events are folded per role first so a role with
+# several points events is still counted once, the same as in the daily rollups
+STATS_PARTS_SELECT = '''
+    SELECT
+        player_id,
+        COUNT(DISTINCT game_id) AS games,
+        SUM( win_events ) AS win_events,
+        SUM( CASE WHEN won THEN point_delta ELSE 0 END ) AS win_delta,
+        SUM( won ) AS won_games,
+        MAX( CASE WHEN win_events > 0 THEN point_delta ELSE 0 END ) AS max_win,
+        SUM( CASE WHEN loss THEN point_delta ELSE 0 END ) AS loss_delta,
+        SUM( loss ) AS loss_events,
+        MIN( CASE WHEN loss THEN point_delta ELSE 0 END ) AS max_loss,
+        SUM( COALESCE(sell, 0) ) AS sell_points,
+        SUM( role = 'SELLER' ) AS seller_rows,
+        MAX( COALESCE(sell, 0) ) AS max_sell
+    FROM (
+        SELECT
+            r.game_id,
+            r.player_id,
+            r.role,
+            r.point_delta,
+            COALESCE( g.winner_id = r.player_id, 0 ) AS won,
+            COALESCE( SUM( pe.event_type = 'WIN' ), 0 ) AS win_events,
+            COALESCE( MAX( pe.event_type = 'LOSS_MULTIPLIER' ), 0 ) AS loss,
+            MAX( CASE WHEN pe.event_type = 'SELL' THEN pe.points END ) AS sell
+        FROM {schema}.roles r
+        LEFT JOIN {schema}.games g ON g.id = r.game_id
+        LEFT JOIN {schema}.points_events pe ON pe.role_id = r.id
+        GROUP BY r.id
+    )
+    GROUP BY player_id
+'''
+
+STATS_PARTS_COLUMNS = '''player_id, games, win_events, win_delta, won_games, max_win, loss_delta,
+    loss_events, max_loss, sell_points, seller_rows, max_sell'''
+
+# Columns that can be requested with fields=, mapped to their SQL expressions
+PLAYER_FIELDS = {
+    "id": "players.id",
+    "name": "players.name",
+    "username": "players.username",
+    "balance": "players.balance",
+    "is_admin": "players.is_admin",
+    "rating": "ROUND( COALESCE( pr.rating, :initial_rating ), 1 )",
+}
+
+GAME_FIELDS = {
+    "game_id": "g.id",
+    "created_at": "CAST( strftime('%s', g.created_at) AS INTEGER )",
+    "created_ts": "CAST( strftime('%s', g.created_at) AS INTEGER )",
+    "winner_name": "winner.name",
+    "players": """json_group_array(
+                            json_object(
+                                'player_name', p.name,
+                                'role', r.role,
+                                'point_delta', r.point_delta
+                            )
+                        )""",
+}
+
+STATS_FIELDS = {
+    "id": "p.id",
+    "name": "p.name",
+    "username": "p.username",
+    "games_played": "COALESCE( SUM( parts.games ), 0 )",
+    "win_percentage": "ROUND( 100.0 * SUM( parts.win_events ) / SUM( parts.games ), 2 )",
+    "avg_points_per_win": "ROUND( 1.0 * SUM( parts.win_delta ) / NULLIF( SUM( parts.won_games ), 0 ), 2 )",
+    "max_win": "NULLIF( MAX( parts.max_win ), 0 )",
+    "avg_points_per_loss": "ROUND( 1.0 * SUM( parts.loss_delta ) / SUM( parts.loss_events ), 2 )",
+    "max_loss": "NULLIF( MIN( parts.max_loss ), 0 )",
+    "avg_sell": "ROUND( 1.0 * SUM( parts.sell_points ) / SUM( parts.seller_rows ), 2 )",
+    "max_sell": "NULLIF( MAX( parts.max_sell ), 0 )",
+    "rating": "ROUND( COALESCE( pr.rating, :initial_rating ), 1 )",
+}
+
+RANGE_STATS_FIELDS = {
+    "id": "p.id",
+    "name": "p.name",
+    "username": "p.username",
+    "games_played": "COALESCE( SUM( parts.games ), 0 )",
+    "win_percentage": "ROUND( 100.0 * SUM( parts.wins ) / SUM( parts.games ), 2 )",
+    "avg_points_per_win": "ROUND( 1.0 * SUM( parts.win_points ) / NULLIF( SUM( parts.wins ), 0 ), 2 )",
+    "max_win": "MAX( parts.max_win )",
+    "avg_points_per_loss": "ROUND( 1.0 * SUM( parts.loss_points ) / SUM( parts.losses ), 2 )",
+    "max_loss": "MIN( parts.max_loss )",
+    "avg_sell": "ROUND( 1.0 * SUM( parts.sell_points ) / SUM( parts.seller_games ), 2 )",
+    "max_sell": "MAX( parts.max_sell )",
+    "rating": "ROUND( COALESCE( pr.rating, :initial_rating ), 1 )",
+}
+
+def select_list(columns, fields=None):
+    """
+    Build a SELECT list of the requested fields, every column when fields is None
+    """
+    return ", ".join(f"{columns[field]} AS {field}" for field in (fields or columns))
+
+def league_db_path(league=None):
+    """
+    Get the database file of a league, the default database when league is None
+    """
+    if league is None:
+        return DEFAULT_DB
+
+    if LEAGUE_DIR is None or not LEAGUE_PATTERN.match(league):
+        raise ValueError(f"Unknown league {league}")
+
+    return os.path.join(LEAGUE_DIR, league + ".db")
+
+def league_exists(league):
+    """
+    Check a league has a database
+    """
+    try:
+        return os.path.exists(league_db_path(league))
+    except ValueError:
+        return False
+
+def list_leagues():
+    """
+    Get the id of every league with a database in LEAGUE_DIR
+    """
+    if LEAGUE_DIR is None or not os.path.isdir(LEAGUE_DIR):
+        return []
+
+    names = [n[:-3] for n in os.listdir(LEAGUE_DIR) if n.endswith(".db")]
+    return sorted(n for n in names if LEAGUE_PATTERN.match(n))
+
+def archive_db_path(path):
+    """
+    Get the archive database of a live database, foo.db keeps its old games in foo.archive.db
+    """
+    root, ext = os.path.splitext(path)
+    return root + ".archive" + (ext or ".db")
+
+def connect(path, timeout=5.0):
+    db_con = sqlite3.connect(path, check_same_thread=False, timeout=timeout)
+    db_con.row_factory = sqlite3.Row
+    return db_con
+
+class ConnectionPool():
+    """
+    Idle connections of every open league database, opened lazily on first use. Least
+    recently used leagues are closed once more than max_leagues are open or they sit unused
+    for idle_seconds
+    """
+
+    def __init__(self, size=POOL_SIZE, max_leagues=MAX_OPEN_LEAGUES, idle_seconds=LEAGUE_IDLE_SECONDS):
+        self.size = size
+        self.max_leagues = max_leagues
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        # path -> (last used, idle connections), least recently used first
+        self.leagues = OrderedDict()
+
+    def acquire(self, path):
+        now = time.monotonic()
+        with self.lock:
+            _, idle = self.leagues.pop(path, (now, []))
+            self.leagues[path] = (now, idle)
+            db_con = idle.pop() if idle else None
+            expired = self._expire(now)
+
+        for con in expired:
+            con.close()
+
+        if db_con is None:
+            db_con = connect(path)
+
+        return db_con
+
+    def release(self, path, db_con):
+        # Never hand out a connection with a transaction left open on it
+        if db_con.in_transaction:
+            db_con.rollback()
+
+        with self.lock:
+            league = self.leagues.get(path)
+            if league is not None and len(league[1]) < self.size:
+                league[1].append(db_con)
+                db_con = None
+
+        if db_con is not None:
+            db_con.close()
+
+    def _expire(self, now):
+        """
+        Drop the least recently used leagues over the limits, returns their connections to close
+        """
+        expired = []
+        while len(self.leagues) > 1:
+            path, (last_used, idle) = next(iter(self.leagues.items()))
+            if len(self.leagues) <= self.max_leagues and now - last_used < self.idle_seconds:
+                break
+
+            del self.leagues[path]
+            expired.extend(idle)
+
+        return expired
+
+    def close_all(self):
+        with self.lock:
+            leagues, self.leagues = self.leagues, OrderedDict()
+
+        for _, idle in leagues.values():
+            for con in idle:
+                con.close()
+
+POOL = ConnectionPool()
+
+class GameArchived(Exception):
+    """
+    The game was moved into the archive, which is read-only
+    """
 
 class GostopDB():
 
-    def __init__(self):
-        self.db_con = sqlite3.connect(DEFAULT_DB, check_same_thread=False)
-        self.db_con.row_factory = sqlite3.Row
+    def __init__(self, timeout=5.0, league=None, pooled=True):
+        self.path = league_db_path(league)
+        self.pooled = pooled
+
+        if pooled:
+            self.db_con = POOL.acquire(self.path)
+        else:
+            self.db_con = connect(self.path, timeout)
+
+        # Set by the writer while a group commit owns the transaction
+        self.in_batch = False
+
+        self.archive_path = archive_db_path(self.path)
+        self._attach_archive()
 
     def close(self):
-        self.db_con.close()
+        if self.pooled:
+            POOL.release(self.path, self.db_con)
+        else:
+            self.db_con.close()
+
+    def _commit(self):
+        """
+        Commit the current transaction unless it belongs to a group commit batch
+        """
+        if not self.in_batch:
+            self.db_con.commit()
 
     def create_database(self):
         cur = self.db_con.cursor()
 
-        with open("schema.sql", "r") as f:
+        # The schema adds a unique index on username, older databases may hold duplicates
+        for rename in self._resolve_duplicate_usernames():
+            print("Renamed duplicate username:", json.dumps(rename))
+
+        with open(SCHEMA_PATH, "r") as f:
             sql_script = f.read()
 
         cur.executescript(sql_script)
         self.db_con.commit()
 
+    def _resolve_duplicate_usernames(self):
+        """
+        Rename every player sharing a username with a lower player id to username-<id> so the
+        unique username index can be built, returns the renames
+        """
+        cur = self.db_con.cursor()
+
+        cmd_exists = ''' SELECT name FROM sqlite_master WHERE name IN ('players', 'players_username') '''
+        existing = {row[0] for row in cur.execute(cmd_exists)}
+        if existing != {"players"}:
+            return []
+
+        cmd = ''' SELECT id, username FROM players p
+                  WHERE EXISTS ( SELECT 1 FROM players o WHERE o.username = p.username AND o.id < p.id )
+                  ORDER BY id '''
+        duplicates = cur.execute(cmd).fetchall()
+
+        renames = []
+        for row in duplicates:
+            username = f"{row['username']}-{row['id']}"
+            while cur.execute(''' SELECT 1 FROM players WHERE username = ? ''', (username, )).fetchone() is not None:
+                username += "-" + str(row["id"])
+
+            cur.execute(''' UPDATE players SET username = ? WHERE id = ? ''', (username, row["id"]))
+            renames.append({"id": row["id"], "from": row["username"], "to": username})
+
+        self.db_con.commit()
+        return renames
+
+    def _attach_archive(self):
+        """
+        Attach the archive database as "archive" once it exists, must run outside a transaction
+        """
+        attached = any(row[1] == "archive" for row in self.db_con.execute("PRAGMA database_list"))
+        if not attached and os.path.exists(self.archive_path):
+            self.db_con.execute("ATTACH DATABASE ? AS archive", (self.archive_path, ))
+            attached = True
+
+        self.has_archive = attached
+
+    def _each_schema(self, template, **kwargs):
+        """
+        Run a per schema query template over the live tables and, when attached, the archive
+        tables. Every game lives in one schema with its roles and events, so the parts combine
+        with UNION ALL
+        """
+        schemas = ["main", "archive"] if self.has_archive else ["main"]
+        return "\n UNION ALL \n".join(template.format(schema=schema, **kwargs) for schema in schemas)
+
+    def create_archive(self):
+        """
+        Create the archive database if needed and attach it
+        """
+        archive_con = sqlite3.connect(self.archive_path)
+        try:
+            with open(ARCHIVE_SCHEMA_PATH, "r") as f:
+                archive_con.executescript(f.read())
+            archive_con.commit()
+        finally:
+            archive_con.close()
+
+        self._attach_archive()
+
+    def _get_archive_totals(self):
+        """
+        Get the archive cutoff and totals, None without an archive
+        """
+        if not self.has_archive:
+            return None
+
+        cur = self.db_con.cursor()
+        cmd = ''' SELECT cutoff, games, dealer_games, dealer_wins FROM archive.archive_totals WHERE id = 1 '''
+
+        row = cur.execute(cmd).fetchone()
+        if row is None:
+            return None
+
+        return dict(row)
+
+    def _get_archived_balances(self):
+        """
+        Get the sum of every player's archived point deltas, the balance they carry into the live games
+        """
+        if not self.has_archive:
+            return {}
+
+        cur = self.db_con.cursor()
+        cmd = ''' SELECT player_id, SUM(point_delta) AS points FROM archive.roles GROUP BY player_id '''
+
+        res = cur.execute(cmd)
+        return {row["player_id"]: row["points"] for row in res}
+
+    def _archive_games(self, before_day):
+        """
+        Move every game created before the UTC day before_day, with its roles, points events and
+        daily rollups, from the live database into the archive in one transaction and recompute
+        the archive aggregates. Rows already in the archive are skipped so an interrupted run can
+        simply be repeated
+        """
+        if not self.has_archive:
+            self.create_archive()
+
+        params = {"before_day": before_day, "cutoff": before_day + " 00:00:00"}
+        cur = self.db_con.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+
+        try:
+            cur.execute(''' CREATE TEMP TABLE archiving AS
+                            SELECT id FROM main.games WHERE created_at < :cutoff ''', params)
+            cur.execute(''' CREATE TEMP TABLE archiving_roles AS
+                            SELECT id FROM main.roles WHERE game_id IN (SELECT id FROM temp.archiving) ''')
+
+            cur.execute(''' INSERT OR IGNORE INTO archive.games(id, winner_id, created_at)
+                            SELECT id, winner_id, created_at FROM main.games
+                            WHERE id IN (SELECT id FROM temp.archiving) ''')
+            games = cur.rowcount
+            cur.execute(''' INSERT OR IGNORE INTO archive.roles(id, game_id, player_id, role, point_delta)
+                            SELECT id, game_id, player_id, role, point_delta FROM main.roles
+                            WHERE id IN (SELECT id FROM temp.archiving_roles) ''')
+            roles = cur.rowcount
+            cur.execute(''' INSERT OR IGNORE INTO archive.points_events(id, role_id, event_type, points)
+                            SELECT id, role_id, event_type, points FROM main.points_events
+                            WHERE role_id IN (SELECT id FROM temp.archiving_roles) ''')
+            events = cur.rowcount
+            cur.execute(''' INSERT OR REPLACE INTO archive.player_daily_stats(''' + ROLLUP_COLUMNS + ''')
+                            SELECT ''' + ROLLUP_COLUMNS + ''' FROM main.player_daily_stats
+                            WHERE day < :before_day ''', params)
+
+            cur.execute(''' DELETE FROM main.points_events WHERE role_id IN (SELECT id FROM temp.archiving_roles) ''')
+            cur.execute(''' DELETE FROM main.roles WHERE id IN (SELECT id FROM temp.archiving_roles) ''')
+            cur.execute(''' DELETE FROM main.games WHERE id IN (SELECT id FROM temp.archiving) ''')
+            cur.execute(''' DELETE FROM main.player_daily_stats WHERE day < :before_day ''', params)
+
+            cur.execute(''' DELETE FROM archive.archive_player_stats ''')
+            cur.execute(''' INSERT INTO archive.archive_player_stats(''' + STATS_PARTS_COLUMNS + ''') '''
+                        + STATS_PARTS_SELECT.format(schema="archive"))
+
+            cur.execute(''' INSERT OR REPLACE INTO archive.archive_totals(id, cutoff, games, dealer_games, dealer_wins)
+                            SELECT
+                                1,
+                                MAX( :before_day, COALESCE( (SELECT cutoff FROM archive.archive_totals WHERE id = 1), '' ) ),
+                                (SELECT COUNT(*) FROM archive.games),
+                                COUNT(*),
+                                COALESCE( SUM( CASE WHEN r.player_id = g.winner_id THEN 1 ELSE 0 END ), 0 )
+                            FROM archive.games g
+                            JOIN archive.roles r ON g.id = r.game_id
+                            WHERE r.role = 'DEALER' ''', params)
+
+            cur.execute(''' DROP TABLE temp.archiving ''')
+            cur.execute(''' DROP TABLE temp.archiving_roles ''')
+            self.db_con.commit()
+        except Exception:
+            self.db_con.rollback()
+            raise
+
+        return {"cutoff": before_day, "games": games, "roles": roles, "points_events": events}
+
+    def _get_league_timezone(self):
+        """
+        Get the timezone game times are shown in for this league
+        """
+        cur = self.db_con.cursor()
+        cmd = ''' SELECT timezone FROM league_settings WHERE id = 1 '''
+
+        res = cur.execute(cmd)
+        row = res.fetchone()
+        if row is None:
+            return DEFAULT_TIMEZONE
+
+        return row["timezone"]
+
+    def _set_league_timezone(self, tz_name):
+        """
+        Set the timezone game times are shown in for this league
+        """
+        cur = self.db_con.cursor()
+        cmd = ''' INSERT INTO league_settings(id, timezone) VALUES (1, ?)
+                    ON CONFLICT(id) DO UPDATE SET timezone = excluded.timezone '''
+
+        cur.execute(cmd, (tz_name, ))
+        self._commit()
+
+    def _get_data_version(self):
+        """
+        Get the data version, bumped by the schema triggers on every write
+        """
+        cur = self.db_con.cursor()
+        cmd = ''' SELECT version FROM data_version WHERE id = 1 '''
+
+        res = cur.execute(cmd)
+        row = res.fetchone()
+        if row is None:
+            return 0
+
+        return row["version"]
+
+    def _check_consistency(self, full=False):
+        """
+        Check every game's point deltas sum to zero and every player's balance is the sum of their
+        role deltas. Only the games and players changed since the stored watermark, or still in
+        violation, are checked unless full is set or no check has run yet
+        """
+        cur = self.db_con.cursor()
+        cur.execute("BEGIN")
+
+        try:
+            row = cur.execute(''' SELECT seq FROM consistency_watermark WHERE id = 1 ''').fetchone()
+            since = row["seq"] if row is not None else None
+            full = full or since is None
+
+            row = cur.execute(''' SELECT MAX(seq) AS seq FROM consistency_changes ''').fetchone()
+            seq = max(row["seq"] or 0, since or 0)
+
+            if full:
+                game_ids = player_ids = None
+                games_where = players_where = balances_where = "1"
+            else:
+                cmd_games = ''' SELECT game_id FROM consistency_changes WHERE seq > :since AND game_id IS NOT NULL
+                                UNION
+                                SELECT entity_id FROM consistency_violations WHERE kind = 'game' '''
+                game_ids = [r[0] for r in cur.execute(cmd_games, {"since": since})]
+
+                cmd_players = ''' SELECT player_id FROM consistency_changes WHERE seq > :since AND player_id IS NOT NULL
+                                  UNION
+                                  SELECT entity_id FROM consistency_violations WHERE kind = 'player' '''
+                player_ids = [r[0] for r in cur.execute(cmd_players, {"since": since})]
+
+                games_where = "game_id IN (SELECT value FROM json_each(:game_ids))"
+                players_where = "player_id IN (SELECT value FROM json_each(:player_ids))"
+                balances_where = "p.id IN (SELECT value FROM json_each(:player_ids))"
+
+            params = {"game_ids": json.dumps(game_ids), "player_ids": json.dumps(player_ids)}
+
+            games = []
+            if full or game_ids:
+                cmd = ''' SELECT game_id, SUM(points) AS delta_sum
+                          FROM ( ''' + self._each_schema('''
+                              SELECT game_id, SUM(point_delta) AS points
+                              FROM {schema}.roles
+                              WHERE ''' + games_where + '''
+                              GROUP BY game_id ''') + '''
+                          )
+                          GROUP BY game_id
+                          HAVING SUM(points) != 0
+                          ORDER BY game_id '''
+                games = [dict(r) for r in cur.execute(cmd, params)]
+
+            players = []
+            if full or player_ids:
+                cmd = ''' SELECT p.id AS player_id, p.balance, COALESCE( SUM(d.points), 0 ) AS expected
+                          FROM players p
+                          LEFT JOIN ( ''' + self._each_schema('''
+                              SELECT player_id, SUM(point_delta) AS points
+                              FROM {schema}.roles
+                              WHERE ''' + players_where + '''
+                              GROUP BY player_id ''') + '''
+                          ) d ON d.player_id = p.id
+                          WHERE ''' + balances_where + '''
+                          GROUP BY p.id
+                          HAVING p.balance != COALESCE( SUM(d.points), 0 )
+                          ORDER BY p.id '''
+                players = [dict(r) for r in cur.execute(cmd, params)]
+        finally:
+            self.db_con.rollback()
+
+        return {
+            "full": full,
+            "watermark": seq,
+            "game_ids": game_ids,
+            "player_ids": player_ids,
+            "games": games,
+            "players": players,
+        }
+
+    def _save_consistency(self, result):
+        """
+        Store the violations and watermark of a _check_consistency result and drop the changes it
+        covered. A newer watermark already stored is kept
+        """
+        cur = self.db_con.cursor()
+
+        if result["full"]:
+            cur.execute(''' DELETE FROM consistency_violations ''')
+        else:
+            cmd_clear = ''' DELETE FROM consistency_violations
+                            WHERE kind = ? AND entity_id IN (SELECT value FROM json_each(?)) '''
+            cur.execute(cmd_clear, ("game", json.dumps(result["game_ids"])))
+            cur.execute(cmd_clear, ("player", json.dumps(result["player_ids"])))
+
+        cmd_violation = ''' INSERT OR REPLACE INTO consistency_violations(kind, entity_id, expected, actual)
+                            VALUES(?,?,?,?) '''
+        cur.executemany(cmd_violation, [("game", g["game_id"], 0, g["delta_sum"]) for g in result["games"]])
+        cur.executemany(cmd_violation, [("player", p["player_id"], p["expected"], p["balance"])
+                                        for p in result["players"]])
+
+        cmd_watermark = ''' INSERT INTO consistency_watermark(id, seq) VALUES (1, ?)
+                            ON CONFLICT(id) DO UPDATE SET
+                                seq = MAX( seq, excluded.seq ),
+                                checked_at = CURRENT_TIMESTAMP '''
+        cur.execute(cmd_watermark, (result["watermark"], ))
+
+        cur.execute(''' DELETE FROM consistency_changes
+                        WHERE seq <= (SELECT seq FROM consistency_watermark WHERE id = 1) ''')
+
+        self._commit()
+
     def _insert_new_points_event(self, role_id, event_type, points):
         """
         Insert a new row into points_events table
@@ -41,35 +655,78 @@ class GostopDB():
         cur = self.db_con.cursor()
         cur.execute(cmd, (role_id, event_type, points))
 
-        self.db_con.commit()
+        self._commit()
 
         return cur.lastrowid
 
-    def _get_player_over_time(self):
+    def _fetch_array(self, cmd, params=(), width=1, chunk_size=FETCH_CHUNK_ROWS):
         """
-        Get player over time point deltas
+        Stream an all integer query into an (n, width) int64 array, converting the cursor chunk by
+        chunk so no row objects are kept around for the whole result
         """
         cur = self.db_con.cursor()
-        cmd = '''
-            SELECT 
-                r.player_id AS player_id,
-                p.name AS player_name,
-                g.id AS game_id,
-                r.point_delta
-            FROM roles r
-            JOIN games g ON r.game_id = g.id
-            JOIN players p ON r.player_id = p.id
-            ORDER BY g.created_at
-            '''
+        cur.row_factory = None
+        cur.execute(cmd, params)
+
+        blocks = []
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            blocks.append(np.array(rows, dtype=np.int64))
+
+        if not blocks:
+            return np.zeros((0, width), dtype=np.int64)
+
+        return np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+
+    def _fetch_columns(self, cmd, params=(), columns=(), chunk_size=FETCH_CHUNK_ROWS):
+        """
+        Stream an all integer query into one int64 array per named column
+        """
+        data = self._fetch_array(cmd, params, len(columns), chunk_size)
+        return {name: data[:, i] for i, name in enumerate(columns)}
+
+    def _is_admin(self, username):
+        """
+        Check a username belongs to an admin player
+        """
+        cur = self.db_con.cursor()
+        cmd = ''' SELECT 1 FROM players WHERE username = ? AND is_admin = 1 '''
+
+        return cur.execute(cmd, (username, )).fetchone() is not None
+
+    def _get_player_names(self):
+        """
+        Get every player name by player id
+        """
+        cur = self.db_con.cursor()
+        cmd = ''' SELECT id, name FROM players '''
 
         res = cur.execute(cmd)
-        r_obj = res.fetchall()
-        po_dict = [dict(r) for r in r_obj]
+        return {row["id"]: row["name"] for row in res}
 
-        if len(po_dict) == 0:
-            return None
+    def _get_player_over_time(self):
+        """
+        Get player over time point deltas as player_id, game_id and point_delta columns in
+        game creation order
+        """
+        cmd = '''
+            SELECT player_id, game_id, point_delta
+            FROM ( ''' + self._each_schema('''
+                SELECT 
+                    r.player_id AS player_id,
+                    g.id AS game_id,
+                    r.point_delta,
+                    g.created_at
+                FROM {schema}.roles r
+                JOIN {schema}.games g ON r.game_id = g.id
+                JOIN players p ON r.player_id = p.id ''') + '''
+            )
+            ORDER BY created_at
+            '''
 
-        return po_dict
+        return self._fetch_columns(cmd, columns=("player_id", "game_id", "point_delta"))
 
     def _get_role(self, role_id=None):
         """
@@ -103,7 +760,7 @@ class GostopDB():
         cur = self.db_con.cursor()
         cur.execute(cmd, (game_id, player_id, role, 0))
 
-        self.db_con.commit()
+        self._commit()
 
         return cur.lastrowid
 
@@ -118,7 +775,7 @@ class GostopDB():
         cur = self.db_con.cursor()
         cur.execute(cmd, (name, username, 0))
 
-        self.db_con.commit()
+        self._commit()
 
         return cur.lastrowid
 
@@ -134,7 +791,7 @@ class GostopDB():
         cur = self.db_con.cursor()
         cur.execute(cmd, { "winner_id": winner_id, "game_id": game_id })
 
-        self.db_con.commit()
+        self._commit()
 
     def _insert_new_game(self, winner_id):
         """
@@ -147,7 +804,7 @@ class GostopDB():
         cur = self.db_con.cursor()
         cur.execute(cmd, (winner_id, ))
 
-        self.db_con.commit()
+        self._commit()
 
         return cur.lastrowid
 
@@ -163,7 +820,7 @@ class GostopDB():
         cur = self.db_con.cursor()
         cur.execute(cmd, (new_point_delta, role_id))
 
-        self.db_con.commit()
+        self._commit()
 
     def _update_player_balance(self, player_id, new_balance):
         """
@@ -176,14 +833,18 @@ class GostopDB():
         cur = self.db_con.cursor()
         cur.execute(cmd, (new_balance, player_id))
 
-        self.db_con.commit()
+        self._commit()
 
     def _get_num_games(self):
         """
         Get the information about a specific game by id
         """
 
-        get_cmd = ''' SELECT COUNT(*) AS total_games FROM games '''
+        get_cmd = ''' SELECT games AS total_games FROM game_counter WHERE id = 1 '''
+        if self.has_archive:
+            get_cmd = ''' SELECT
+                            (SELECT games FROM main.game_counter WHERE id = 1)
+                          + COALESCE( (SELECT games FROM archive.archive_totals WHERE id = 1), 0 ) AS total_games '''
 
         cur = self.db_con.cursor()
         res = cur.execute(get_cmd)
@@ -195,6 +856,25 @@ class GostopDB():
 
         return game_dict
 
+    def _get_leaderboard(self, top):
+        """
+        Get the top players by balance with their rank, players with the same balance share a rank
+        """
+        cur = self.db_con.cursor()
+        cmd = ''' SELECT id, name, balance
+                  FROM players
+                  ORDER BY balance DESC, id
+                  LIMIT ? '''
+
+        leaders = []
+        for i, row in enumerate(cur.execute(cmd, (top, ))):
+            leader = dict(row)
+            tied = leaders and leaders[-1]["balance"] == leader["balance"]
+            leader["rank"] = leaders[-1]["rank"] if tied else i + 1
+            leaders.append(leader)
+
+        return leaders
+
     def _get_game_players(self, game_id):
         """
         Get the information about a specific game by id
@@ -215,113 +895,109 @@ class GostopDB():
 
         return game_dict
 
-    def _get_games_layout(self, game_id=None):
+    def _get_games_layout(self, game_id=None, fields=None):
         """
-        Get the last games
+        Get the last games, only the requested fields when fields is given
         """
         cur = self.db_con.cursor()
 
-        if game_id is None:
-            cmd = '''SELECT 
-                        g.id AS game_id,
-                        g.created_at AS created_at,
-                        winner.name AS winner_name,
-                        json_group_array(
-                            json_object(
-                                'player_name', p.name,
-                                'role', r.role,
-                                'point_delta', r.point_delta
-                            )
-                        ) AS players
+        select_cmd = ''' SELECT ''' + select_list(GAME_FIELDS, fields) + '''
                     FROM games g
                     JOIN players winner ON g.winner_id = winner.id
                     JOIN roles r ON r.game_id = g.id
-                    JOIN players p ON r.player_id = p.id
+                    JOIN players p ON r.player_id = p.id '''
+
+        if game_id is None:
+            cmd = select_cmd + '''
                     GROUP BY g.id, winner.name
                     ORDER BY g.created_at DESC
                     LIMIT 100 '''
             res = cur.execute(cmd)
         else:
-            cmd = '''SELECT 
-                        g.id AS game_id,
-                        g.created_at AS created_at,
-                        winner.name AS winner_name,
-                        json_group_array(
-                            json_object(
-                                'player_name', p.name,
-                                'role', r.role,
-                                'point_delta', r.point_delta
-                            )
-                        ) AS players
-                    FROM games g
-                    JOIN players winner ON g.winner_id = winner.id
-                    JOIN roles r ON r.game_id = g.id
-                    JOIN players p ON r.player_id = p.id
+            cmd = select_cmd + '''
                     WHERE g.id = ?
                     GROUP BY g.id, winner.name '''
             res = cur.execute(cmd, (game_id, ))
 
         g_obj = res.fetchall()
         game_dict = [dict(g) for g in g_obj]
-        
-        for game in game_dict:
-            game["players"] = json.loads(game["players"])
-
-            # Convert the UTC created_at to Eastern Time (handles DST automatically)
-            if "created_at" in game:
-                utc_time = datetime.fromisoformat(game.get("created_at")).replace(tzinfo=ZoneInfo("UTC"))
-                local_time = utc_time.astimezone(ZoneInfo("America/New_York"))
-                game["created_at"] = local_time.strftime("%Y-%m-%d %H:%M:%S")
-
         if len(game_dict) == 0:
             return None
 
+        # Epochs from SQLite, localized to the league timezone for the whole page at once
+        if "created_at" in game_dict[0]:
+            local_times = localize_epochs([game["created_at"] for game in game_dict], self._get_league_timezone())
+            for game, local_time in zip(game_dict, local_times):
+                game["created_at"] = local_time
+
+        # Already JSON from SQLite, written into the response without a parse and re-encode
+        if "players" in game_dict[0]:
+            for game in game_dict:
+                game["players"] = RawJSON(game["players"])
+
         return game_dict
 
     def _get_game_for_edit(self, game_id):
         """
         Get the information about a specific game by id
         """
+        games = self._get_games_for_edit([game_id])
+        if game_id not in games:
+            return None
+
+        return [games[game_id]]
 
+    def _get_games_for_edit(self, game_ids):
+        """
+        Get the winner, roles and points events of many games with one flat join, keyed by game id,
+        archived games included
+        """
         cur = self.db_con.cursor()
 
         cmd = '''
-                SELECT 
-                    g.winner_id,
-                    json_group_array(
-                        json_object(
-                            'id', r.player_id,
-                            'role', r.role,
-                            'points_events', (
-                                SELECT json_group_array(
-                                    json_object(
-                                        'event_type', pe.event_type,
-                                        'points', pe.points
-                                    )
-                                )
-                                FROM points_events pe
-                                WHERE pe.role_id = r.id
-                            )
-                        )
-                    ) AS players
-                FROM games g
-                LEFT JOIN roles r ON g.id = r.game_id
-                WHERE g.id = ?
-                GROUP BY g.id;
+                SELECT * FROM ( ''' + self._each_schema('''
+                    SELECT
+                        g.id AS game_id,
+                        g.winner_id,
+                        r.id AS role_id,
+                        r.player_id,
+                        r.role,
+                        pe.event_type,
+                        pe.points,
+                        pe.id AS event_id
+                    FROM {schema}.games g
+                    LEFT JOIN {schema}.roles r ON g.id = r.game_id
+                    LEFT JOIN {schema}.points_events pe ON pe.role_id = r.id
+                    WHERE g.id IN ( SELECT value FROM json_each(:ids) ) ''') + ''' )
+                ORDER BY game_id, role_id, event_id
                 '''
 
-        res = cur.execute(cmd, (game_id, ))
-        
-        g_obj = res.fetchall()
-        game_dict = [dict(g) for g in g_obj]
+        res = cur.execute(cmd, {"ids": json.dumps(list(game_ids))})
 
-        for game in game_dict:
-            game["players"] = json.loads(game["players"])
+        games = {}
+        role = None
+        for row in res:
+            game = games.get(row["game_id"])
+            if game is None:
+                game = {"winner_id": row["winner_id"], "players": []}
+                games[row["game_id"]] = game
+                role = None
 
-        if len(game_dict) == 0:
-            return None
+            if row["role_id"] is None:
+                continue
 
-        return game_dict
+            if role is None or role["role_id"] != row["role_id"]:
+                role = {"role_id": row["role_id"], "id": row["player_id"], "role": row["role"], "points_events": []}
+                game["players"].append(role)
+
+            if row["event_type"] is not None:
+                role["points_events"].append({"event_type": row["event_type"], "points": row["points"]})
+
+        for game in games.values():
+            for player in game["players"]:
+                del player["role_id"]
+
+        return games
 
     def _get_game(self, game_id=None):
         """
@@ -344,35 +1020,310 @@ class GostopDB():
 
         return game_dict
 
-    def _get_player_stats(self):
+    def _get_player_stats(self, fields=None):
         """
         Get a bunch of stats (games_played, won, win_percentage, avg_points_per_win, avg_sell, max_sell) for every player
         """
         cur = self.db_con.cursor()
 
+        # The archived games only contribute their stored parts
+        parts_cmd = STATS_PARTS_SELECT.format(schema="main")
+        if self.has_archive:
+            parts_cmd += '''
+            UNION ALL
+            SELECT ''' + STATS_PARTS_COLUMNS + ''' FROM archive.archive_player_stats '''
+
         cmd = '''
-            SELECT 
-                p.id,
-                p.name,
-                p.username,
-                COUNT(DISTINCT r.game_id) AS games_played,
-                ROUND( 100.0 * SUM ( CASE WHEN pevs.event_type = 'WIN' THEN 1 ELSE 0 END) / COUNT(DISTINCT r.game_id), 2 ) AS win_percentage,
-                ROUND( 1.0 * SUM( CASE WHEN g.winner_id = p.id THEN r.point_delta ELSE 0 END) / NULLIF(COUNT(DISTINCT g.id), 0), 2 ) AS avg_points_per_win,
-                NULLIF( MAX( CASE WHEN pevs.event_type = 'WIN' THEN r.point_delta ELSE 0 END), 0) AS max_win,
-                ROUND( 1.0 * SUM( CASE WHEN pevs.event_type = 'LOSS_MULTIPLIER' THEN r.point_delta ELSE 0 END) / SUM ( CASE WHEN pevs.event_type = 'LOSS_MULTIPLIER' THEN 1 ELSE 0 END), 2) AS avg_points_per_loss,
-                NULLIF( MIN( CASE WHEN pevs.event_type = 'LOSS_MULTIPLIER' THEN r.point_delta ELSE 0 END ), 0) AS max_loss,
-                ROUND( 1.0 * SUM( CASE WHEN pevs.event_type = 'SELL' THEN pevs.points ELSE 0 END ) / SUM ( CASE WHEN r.role = 'SELLER' THEN 1 ELSE 0 END ), 2 ) AS avg_sell,
-                NULLIF( MAX( CASE WHEN pevs.event_type = 'SELL' THEN pevs.points ELSE 0 END ), 0) AS max_sell
+            WITH parts AS ( ''' + parts_cmd + ''' )
+            SELECT ''' + select_list(STATS_FIELDS, fields) + '''
             FROM players p
-            LEFT JOIN roles r ON p.id = r.player_id
-            LEFT JOIN games g ON g.id = r.game_id AND g.winner_id = p.id
-            LEFT JOIN points_events pevs ON r.id = pevs.role_id
+            LEFT JOIN player_ratings pr ON pr.player_id = p.id
+            LEFT JOIN parts ON parts.player_id = p.id
             GROUP BY p.id, p.name
-            ORDER BY games_played DESC;
+            ORDER BY COALESCE( SUM( parts.games ), 0 ) DESC;
+            '''
+
+        res = cur.execute(cmd, {"initial_rating": INITIAL_RATING})
+
+        s_obj = res.fetchall()
+        stats_dict = [dict(s) for s in s_obj]
+        if len(stats_dict) == 0:
+            return None
+
+        return stats_dict
+
+    def _get_head_to_head(self):
+        """
+        Get games together, wins and net points transferred for every ordered pair of players
+
+        Transfers are rebuilt pairwise from the points events, mirroring the scoring rules: losers
+        pay the winner (win + sell) * multiplier, non dealers pay the seller the sell points and
+        everyone but the seller pays a first round locker 5 points
+        """
+        cur = self.db_con.cursor()
+
+        cmd = '''
+            WITH role_events AS ( ''' + self._each_schema('''
+                SELECT
+                    r.game_id,
+                    r.player_id,
+                    r.role,
+                    MAX( CASE WHEN pe.event_type = 'LOSS_MULTIPLIER' THEN pe.points END ) AS multiplier,
+                    MAX( CASE WHEN pe.event_type = 'FIRST_ROUND_LOCK' THEN 1 ELSE 0 END ) AS frl,
+                    MAX( CASE WHEN pe.event_type = 'WIN' THEN pe.points END ) AS win_points,
+                    MAX( CASE WHEN pe.event_type = 'SELL' THEN pe.points END ) AS sell_points
+                FROM {schema}.roles r
+                LEFT JOIN {schema}.points_events pe ON pe.role_id = r.id
+                GROUP BY r.id ''') + '''
+            ),
+            game_events AS (
+                SELECT
+                    game_id,
+                    MAX( CASE WHEN win_points IS NOT NULL THEN player_id END ) AS winner_id,
+                    MAX( win_points ) AS win_points,
+                    MAX( CASE WHEN sell_points IS NOT NULL THEN player_id END ) AS seller_id,
+                    COALESCE( MAX( sell_points ), 0 ) AS sell_points
+                FROM role_events
+                GROUP BY game_id
+            )
+            SELECT
+                a.player_id AS player_id,
+                b.player_id AS opponent_id,
+                COUNT(*) AS games_together,
+                SUM( CASE WHEN ge.winner_id = a.player_id THEN 1 ELSE 0 END ) AS wins,
+                SUM(
+                    -- Paid by b to a
+                    CASE WHEN a.player_id = ge.winner_id AND b.multiplier IS NOT NULL AND b.role != 'SELLER'
+                         THEN (ge.win_points + ge.sell_points) * b.multiplier ELSE 0 END
+                  + CASE WHEN a.player_id = ge.seller_id AND b.role NOT IN ('DEALER', 'SELLER')
+                         THEN ge.sell_points ELSE 0 END
+                  + CASE WHEN a.frl = 1 AND b.role != 'SELLER' THEN 5 ELSE 0 END
+                    -- Paid by a to b
+                  - CASE WHEN b.player_id = ge.winner_id AND a.multiplier IS NOT NULL AND a.role != 'SELLER'
+                         THEN (ge.win_points + ge.sell_points) * a.multiplier ELSE 0 END
+                  - CASE WHEN b.player_id = ge.seller_id AND a.role NOT IN ('DEALER', 'SELLER')
+                         THEN ge.sell_points ELSE 0 END
+                  - CASE WHEN b.frl = 1 AND a.role != 'SELLER' THEN 5 ELSE 0 END
+                ) AS net_points
+            FROM role_events a
+            JOIN role_events b ON a.game_id = b.game_id AND a.player_id != b.player_id
+            JOIN game_events ge ON ge.game_id = a.game_id
+            GROUP BY a.player_id, b.player_id
             '''
 
         res = cur.execute(cmd)
 
+        h_obj = res.fetchall()
+        h2h_dict = [dict(h) for h in h_obj]
+        if len(h2h_dict) == 0:
+            return None
+
+        return h2h_dict
+
+    def _refresh_daily_rollups(self, start_day=None, end_day=None):
+        """
+        Recompute the daily rollups for every day in [start_day, end_day] from the base tables,
+        all days when no bounds are given
+        """
+        start_day = start_day or "0001-01-01"
+        end_day = end_day or "9999-12-30"
+        next_day = datetime.fromisoformat(end_day) + timedelta(days=1)
+        params = {
+            "start_day": start_day,
+            "end_day": end_day,
+            "start": start_day + " 00:00:00",
+            "end": next_day.isoformat(sep=" ", timespec="seconds"),
+        }
+
+        cur = self.db_con.cursor()
+
+        cmd_delete = ''' DELETE FROM player_daily_stats
+                         WHERE day >= :start_day AND day <= :end_day '''
+        cur.execute(cmd_delete, params)
+
+        cmd_insert = ''' INSERT INTO player_daily_stats(day, player_id, games, wins, win_points, max_win,
+                             losses, loss_points, max_loss, seller_games, sells, sell_points, max_sell,
+                             frls, points, dealer_games, dealer_wins) ''' + ROLLUP_SELECT.format(schema="main", start=":start", end=":end")
+        cur.execute(cmd_insert, params)
+
+        self._commit()
+
+    def _backfill_daily_rollups(self):
+        """
+        Build the daily rollups for databases that have games but were created before the rollups
+        """
+        cur = self.db_con.cursor()
+
+        cmd = ''' SELECT
+                    EXISTS (SELECT 1 FROM games) AS has_games,
+                    EXISTS (SELECT 1 FROM player_daily_stats) AS has_rollups '''
+
+        row = cur.execute(cmd).fetchone()
+        if row["has_games"] and not row["has_rollups"]:
+            self._refresh_daily_rollups()
+
+    def _ratings_missing(self):
+        """
+        Check for databases that have games but were created before the ratings
+        """
+        cur = self.db_con.cursor()
+
+        cmd = ''' SELECT
+                    EXISTS (SELECT 1 FROM games) AS has_games,
+                    EXISTS (SELECT 1 FROM player_ratings) AS has_ratings '''
+
+        row = cur.execute(cmd).fetchone()
+        totals = self._get_archive_totals()
+        has_games = row["has_games"] or (totals is not None and totals["games"] > 0)
+        return bool(has_games and not row["has_ratings"])
+
+    def _get_ratings(self, player_ids):
+        """
+        Get the current rating of the given players, unrated players are not returned
+        """
+        cur = self.db_con.cursor()
+
+        cmd = ''' SELECT player_id, rating, games
+                  FROM player_ratings
+                  WHERE player_id IN (SELECT value FROM json_each(?)) '''
+
+        res = cur.execute(cmd, (json.dumps(list(player_ids)), ))
+
+        r_obj = res.fetchall()
+        return [dict(r) for r in r_obj]
+
+    def _get_rating_games(self, from_game_id):
+        """
+        Get the roles of every game at or after from_game_id in rating order
+        """
+        cur = self.db_con.cursor()
+
+        cmd = self._each_schema(''' SELECT g.id AS game_id, g.winner_id, r.player_id, r.role
+                  FROM {schema}.games g
+                  JOIN {schema}.roles r ON r.game_id = g.id
+                  WHERE g.id >= :from_game_id ''') + '''
+                  ORDER BY game_id '''
+
+        res = cur.execute(cmd, {"from_game_id": from_game_id})
+
+        r_obj = res.fetchall()
+        return [dict(r) for r in r_obj]
+
+    def _save_game_ratings(self, game_id, before, after):
+        """
+        Checkpoint the participants ratings from before a game and store their ratings after it,
+        before and after map player ids to (rating, games)
+        """
+        cur = self.db_con.cursor()
+
+        cmd_checkpoint = ''' INSERT OR REPLACE INTO rating_checkpoints(game_id, player_id, rating, games)
+                             VALUES(?,?,?,?) '''
+        cur.executemany(cmd_checkpoint, [(game_id, player_id, rating, games)
+                                         for player_id, (rating, games) in before.items()])
+
+        cmd_rating = ''' INSERT INTO player_ratings(player_id, rating, games)
+                         VALUES(?,?,?)
+                         ON CONFLICT(player_id) DO UPDATE SET rating = excluded.rating, games = excluded.games '''
+        cur.executemany(cmd_rating, [(player_id, rating, games)
+                                     for player_id, (rating, games) in after.items()])
+
+        self._commit()
+
+    def _rewind_ratings(self, game_id):
+        """
+        Restore every player to their rating from before game_id and drop the later checkpoints
+        """
+        cur = self.db_con.cursor()
+
+        cmd_restore = ''' UPDATE player_ratings
+                          SET (rating, games) = (
+                              SELECT c.rating, c.games
+                              FROM rating_checkpoints c
+                              WHERE c.player_id = player_ratings.player_id AND c.game_id >= :game_id
+                              ORDER BY c.game_id
+                              LIMIT 1
+                          )
+                          WHERE player_id IN (
+                              SELECT player_id FROM rating_checkpoints WHERE game_id >= :game_id
+                          ) '''
+        cur.execute(cmd_restore, {"game_id": game_id})
+
+        cmd_delete = ''' DELETE FROM rating_checkpoints
+                         WHERE game_id >= :game_id '''
+        cur.execute(cmd_delete, {"game_id": game_id})
+
+        self._commit()
+
+    def _clear_ratings(self):
+        """
+        Remove every rating and checkpoint
+        """
+        cur = self.db_con.cursor()
+
+        cur.execute(''' DELETE FROM rating_checkpoints ''')
+        cur.execute(''' DELETE FROM player_ratings ''')
+
+        self._commit()
+
+    def _range_parts(self, start, end):
+        """
+        Build the per day, per player rows covering [start, end), whole days come from the daily
+        rollups and the partial days at either edge are aggregated exactly from the base tables
+        """
+        start_ts = start.isoformat(sep=" ", timespec="seconds")
+        end_ts = end.isoformat(sep=" ", timespec="seconds")
+
+        # Whole days are the ones starting at or after start that also end at or before end
+        full_from = start.date() if start.time() == datetime.min.time() else start.date() + timedelta(days=1)
+        full_to = end.date()
+
+        if full_from < full_to:
+            full_from_ts = full_from.isoformat() + " 00:00:00"
+            full_to_ts = full_to.isoformat() + " 00:00:00"
+            params = {
+                "full_from": full_from.isoformat(), "full_to": full_to.isoformat(),
+                "lower_start": start_ts, "lower_end": full_from_ts,
+                "upper_start": full_to_ts, "upper_end": end_ts,
+            }
+        else:
+            params = {
+                "full_from": "", "full_to": "",
+                "lower_start": start_ts, "lower_end": end_ts,
+                "upper_start": end_ts, "upper_end": end_ts,
+            }
+
+        # Archived days keep their rollups and games in the archive, so each schema covers its own
+        cmd = self._each_schema('''
+            SELECT ''' + ROLLUP_COLUMNS + '''
+            FROM {schema}.player_daily_stats
+            WHERE day >= :full_from AND day < :full_to
+            UNION ALL
+            ''' + ROLLUP_SELECT.format(schema="{schema}", start=":lower_start", end=":lower_end") + '''
+            UNION ALL
+            ''' + ROLLUP_SELECT.format(schema="{schema}", start=":upper_start", end=":upper_end"))
+
+        return cmd, params
+
+    def _get_player_stats_range(self, start, end, fields=None):
+        """
+        Get the player stats for the games created in [start, end) by summing the daily rollups
+        """
+        cur = self.db_con.cursor()
+
+        parts_cmd, params = self._range_parts(start, end)
+        params["initial_rating"] = INITIAL_RATING
+        cmd = '''
+            WITH parts AS ( ''' + parts_cmd + ''' )
+            SELECT ''' + select_list(RANGE_STATS_FIELDS, fields) + '''
+            FROM players p
+            LEFT JOIN player_ratings pr ON pr.player_id = p.id
+            LEFT JOIN parts ON parts.player_id = p.id
+            GROUP BY p.id, p.name
+            ORDER BY COALESCE( SUM( parts.games ), 0 ) DESC;
+            '''
+
+        res = cur.execute(cmd, params)
+
         s_obj = res.fetchall()
         stats_dict = [dict(s) for s in s_obj]
         if len(stats_dict) == 0:
@@ -380,6 +1331,51 @@ class GostopDB():
 
         return stats_dict
 
+    def _get_win_deal_data_range(self, start, end):
+        """
+        Get the percentage where the dealer is also the winner for the games created in [start, end)
+        """
+        cur = self.db_con.cursor()
+
+        parts_cmd, params = self._range_parts(start, end)
+        cmd = '''
+            WITH parts AS ( ''' + parts_cmd + ''' )
+            SELECT
+                ROUND( 100.0 * SUM( dealer_wins ) / SUM( dealer_games ), 2 ) AS dealer_win_percentage
+            FROM parts
+            '''
+
+        res = cur.execute(cmd, params)
+
+        s_obj = res.fetchall()
+        stats_dict = [dict(s) for s in s_obj]
+        if len(stats_dict) == 0:
+            return None
+
+        return stats_dict[0]
+
+    def _get_scoring_roles(self):
+        """
+        Get an (n, 4) array of role id, game id, player id, role code for every role of a stored game
+        """
+        cmd = self._each_schema(''' SELECT r.id, r.game_id, r.player_id,
+                      CASE r.role WHEN 'DEALER' THEN 1 WHEN 'SELLER' THEN 2 ELSE 0 END
+                  FROM {schema}.roles r
+                  WHERE r.game_id IN (SELECT id FROM {schema}.games) ''')
+
+        return self._fetch_array(cmd, width=4)
+
+    def _get_scoring_events(self):
+        """
+        Get an (n, 3) array of role id, event code, points for every points event
+        """
+        cmd = self._each_schema(''' SELECT role_id,
+                      CASE event_type WHEN 'FIRST_ROUND_LOCK' THEN 0 WHEN 'WIN' THEN 1 WHEN 'SELL' THEN 2 ELSE 3 END,
+                      points
+                  FROM {schema}.points_events ''')
+
+        return self._fetch_array(cmd, width=3)
+
     def _get_win_deal_data(self):
         """
         Get the percentage where the dealer is also the winner
@@ -393,6 +1389,19 @@ class GostopDB():
                     FROM games
                     JOIN roles ON games.id = roles.game_id
                     WHERE roles.role = 'DEALER' '''
+        if self.has_archive:
+            cmd = ''' SELECT
+                    ROUND( CAST(SUM(dealer_wins) AS FLOAT) / SUM(dealer_games) * 100, 2) AS dealer_win_percentage
+                    FROM (
+                        SELECT
+                            SUM(CASE WHEN roles.player_id = games.winner_id THEN 1 ELSE 0 END) AS dealer_wins,
+                            COUNT(*) AS dealer_games
+                        FROM main.games
+                        JOIN main.roles ON games.id = roles.game_id
+                        WHERE roles.role = 'DEALER'
+                        UNION ALL
+                        SELECT dealer_wins, dealer_games FROM archive.archive_totals
+                    ) '''
 
         res = cur.execute(cmd)
 
@@ -426,6 +1435,19 @@ class GostopDB():
 
         return game_dict
 
+    def _check_game_writable(self, game_id):
+        """
+        Raise GameArchived when the game was moved into the read-only archive
+        """
+        if not self.has_archive:
+            return
+
+        cur = self.db_con.cursor()
+        cmd = ''' SELECT 1 FROM archive.games WHERE id = ? '''
+
+        if cur.execute(cmd, (game_id, )).fetchone() is not None:
+            raise GameArchived("game is archived (read-only)")
+
     def _delete_game_data(self, game_id):
         """
         Delete all roles and points events for a specific game
@@ -449,7 +1471,7 @@ class GostopDB():
                         WHERE game_id = :game_id '''
         cur.execute(cmd_roles, {"game_id": game_id})
 
-        self.db_con.commit()
+        self._commit()
 
     def _delete_game(self, id):
         """
@@ -463,7 +1485,7 @@ class GostopDB():
                   WHERE id = :game_id '''
 
         cur.execute(cmd, {"game_id": id})
-        self.db_con.commit()
+        self._commit()
 
     def _delete_player(self, id):
         """
@@ -476,36 +1498,37 @@ class GostopDB():
 
         cur.execute(cmd, (id, ))
 
-        self.db_con.commit()
+        self._commit()
 
-    def _get_player(self, name=None, username=None, id=None):
+    def _get_player(self, name=None, username=None, id=None, fields=None):
         """
-        Get the information about a specific player by name
+        Get the information about a specific player by name, only the requested fields when
+        fields is given
         """
         cur = self.db_con.cursor()
 
+        columns = ''' players.*, ROUND( COALESCE( pr.rating, :initial_rating ), 1 ) AS rating '''
+        if fields is not None:
+            columns = select_list(PLAYER_FIELDS, fields)
+
+        select_cmd = ''' SELECT ''' + columns + '''
+                         FROM players
+                         LEFT JOIN player_ratings pr ON pr.player_id = players.id '''
+
         if name is not None:
-            get_cmd = ''' SELECT *
-                        FROM players
-                        WHERE name=? '''
+            get_cmd = select_cmd + ''' WHERE name=:name '''
 
-            res = cur.execute(get_cmd, (name, ))
+            res = cur.execute(get_cmd, {"initial_rating": INITIAL_RATING, "name": name})
         elif id is not None:
-            get_cmd = ''' SELECT *
-                        FROM players
-                        WHERE id=? '''
+            get_cmd = select_cmd + ''' WHERE id=:id '''
 
-            res = cur.execute(get_cmd, (id, ))
+            res = cur.execute(get_cmd, {"initial_rating": INITIAL_RATING, "id": id})
         elif username is not None:
-            get_cmd = ''' SELECT *
-                        FROM players
-                        WHERE username=? '''
+            get_cmd = select_cmd + ''' WHERE username=:username '''
 
-            res = cur.execute(get_cmd, (username, ))
+            res = cur.execute(get_cmd, {"initial_rating": INITIAL_RATING, "username": username})
         else:
-            get_cmd = ''' SELECT * FROM players '''
-
-            res = cur.execute(get_cmd)
+            res = cur.execute(select_cmd, {"initial_rating": INITIAL_RATING})
 
         p_obj = res.fetchall()
         players = [dict(p) for p in p_obj]
@@ -515,6 +1538,29 @@ class GostopDB():
 
         return players
 
+    def _search_players(self, query, limit):
+        """
+        Get the id and name of up to limit players whose name or username has words starting with
+        every word of query, best matches first
+        """
+        # Quote every word so the search syntax can't be injected, * makes it a prefix match
+        words = query.split()
+        if not words:
+            return []
+
+        match = " ".join('"' + w.replace('"', '""') + '"*' for w in words)
+
+        cur = self.db_con.cursor()
+        cmd = ''' SELECT p.id, p.name
+                  FROM players_search s
+                  JOIN players p ON p.id = s.rowid
+                  WHERE players_search MATCH :match
+                  ORDER BY s.rank, p.name
+                  LIMIT :limit '''
+
+        res = cur.execute(cmd, {"match": match, "limit": limit})
+        return [dict(r) for r in res]
+
     def _set_player_name(self, id, name, username):
         """
         Set a player's name
@@ -528,4 +1574,4 @@ class GostopDB():
                 '''
         cur.execute(set_cmd, {"name": name, "username": username, "id": id})
 
-        self.db_con.commit()
+        self._commit()
@@ -2,14 +2,31 @@
 
 from flask import Flask, request, jsonify, make_response, g
 from flask_cors import CORS
-from gostop_database import GostopDB
+from gostop_database import GostopDB, PLAYER_FIELDS, GAME_FIELDS, STATS_FIELDS, RANGE_STATS_FIELDS, MAX_OPEN_LEAGUES
+from gostop_database import LEAGUE_DIR, LEAGUE_PATTERN, GameArchived, league_exists, list_leagues
+from flask.json.provider import DefaultJSONProvider
+from gostop_json import dumps_bytes, loads
+from gostop_timeseries import build_player_timeseries, player_cumulative, DEFAULT_POINTS, MAX_POINTS, MIN_POINTS
+from gostop_rating import game_participants, rate_game, INITIAL_RATING
+from gostop_rules import RuleSet, RULE_SETS, STANDARD_RULES, build_scoring_rows
+from gostop_backup import start_backup_scheduler
+from gostop_writer import GostopWriter, WriterBusy, WriteTimeout
+from gostop_time import valid_timezone
+from gostop_consistency import report as consistency_report
+from gostop_compress import CompressedCache, choose_encoding, compressible
+from gostop_profile import ProfileStore, sampled, start_request_profiler, stop_request_profiler, to_collapsed, to_pstats
+from gostop_capture import RequestLog
 import jwt
 import bcrypt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
 from functools import wraps
 import os
-import pandas as pd
-import matplotlib.pyplot as plt
+import re
+import sqlite3
+import threading
+import time
+from matplotlib.figure import Figure
 import io
 
 ALGORITHM = "HS256"
@@ -17,8 +34,22 @@ RAW_PASSWORD = os.getenv("PASSWORD", "admin1234")
 ACCESS_SECRET_KEY = os.getenv("ACCESS_SECRET_KEY", "asdfalavih23tu8ahlkasjdkf")
 REFRESH_SECRET_KEY = os.getenv("REFRESH_SECRET_KEY", "12385691qweljalksdfakasfdlf")
 
+# Latest bound a stats range is clamped to
+RANGE_MAX = datetime(9999, 12, 31)
+
+# Players sent back by /players/search by default and at most
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+# Players sent back by /leaderboard by default and at most
+LEADERBOARD_TOP = 10
+MAX_LEADERBOARD_TOP = 1000
+
 PASSWORD = bcrypt.hashpw(RAW_PASSWORD.encode('utf-8'), bcrypt.gensalt())
 
+# Every route is also served under /leagues/<league>/ for that league's database
+LEAGUE_PREFIX = re.compile(r"^/leagues/([^/]+)(/.*)?$")
+
 # Middleware to protect routes
 def token_required(f):
     @wraps(f)
@@ -44,41 +75,351 @@ def token_required(f):
 
     return decorated
 
-def generate_tokens(username):
+def generate_tokens(username, league=None):
     access_token = jwt.encode({
         'username': username,
+        'league': league,
         'exp': datetime.utcnow() + timedelta(minutes=1)
     }, ACCESS_SECRET_KEY, algorithm=ALGORITHM)
 
     refresh_token = jwt.encode({
         'username': username,
+        'league': league,
         'exp': datetime.utcnow() + timedelta(days=7)
     }, REFRESH_SECRET_KEY, algorithm=ALGORITHM)
 
     return access_token, refresh_token
 
+def token_claims():
+    """
+    Get the claims of the request's access token, None without a valid token
+    """
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+
+    try:
+        return jwt.decode(auth_header.split(" ")[1], ACCESS_SECRET_KEY, algorithms=[ALGORITHM])
+    except Exception:
+        return None
+
+def is_admin(claims):
+    """
+    Check the user of a token is an admin player of the token's league
+    """
+    league = claims.get("league")
+    if league is not None and not league_exists(league):
+        return False
+
+    gostop_db = GostopDB(league=league)
+    try:
+        return gostop_db._is_admin(claims.get("username"))
+    finally:
+        gostop_db.close()
+
+def admin_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        claims = token_claims()
+        if claims is None:
+            return jsonify({"message": "Token is missing or invalid"}), 401
+
+        if not is_admin(claims):
+            return jsonify({"message": "Admin only"}), 403
+
+        return f(*args, **kwargs)
+
+    return decorated
+
+class LeaguePrefixMiddleware():
+    """
+    Strip a /leagues/<league> prefix off the path so every route serves every league
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        match = LEAGUE_PREFIX.match(environ.get("PATH_INFO", ""))
+        if match is not None:
+            environ["gostop.league"] = match.group(1)
+            environ["PATH_INFO"] = match.group(2) or "/"
+
+        return self.wsgi_app(environ, start_response)
+
+class GostopJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson when it is installed, with RawJSON pass through
+    """
+
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj, indent="indent" in kwargs, default=DefaultJSONProvider.default).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = dumps_bytes(obj, indent=indent, default=DefaultJSONProvider.default)
+
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+def parse_player_names(data):
+    """
+    Get the stripped name and username of a player request body, ValueError when one is missing
+    """
+    name = data.get("name")
+    username = data.get("username")
+    if not isinstance(name, str) or not isinstance(username, str) or not name.strip() or not username.strip():
+        raise ValueError("Player name and username are required")
+
+    return name.strip(), username.strip()
+
+def username_taken(e):
+    """
+    Check an IntegrityError comes from the unique username index and not another constraint
+    """
+    return "UNIQUE constraint failed: players.username" in str(e)
+
+def parse_utc(value):
+    """
+    Parse an ISO date or datetime into a naive UTC datetime, naive input is already UTC
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return parsed
+
 class GostopFlask():
     def __init__(self):
         self.app = Flask(__name__)
+        self.app.json = GostopJSONProvider(self.app)
+        self.app.wsgi_app = LeaguePrefixMiddleware(self.app.wsgi_app)
 
         CORS(self.app, supports_credentials=True, 
                 origins=["http://localhost:5173", "https://tyler-dubuke.com"])
 
+        # League databases are prepared on their first request, the default one right away
+        self.prepared = set()
+        self.prepare_lock = threading.Lock()
+        gostop_db = GostopDB()
+        self._prepare_database(None, gostop_db)
+        gostop_db.close()
+
+        # Derived responses per league, only valid for a single data version
+        self.version_caches = OrderedDict()
+        # Compressed response bodies, kept apart so they never push derived values out
+        self.compressed = CompressedCache()
+
+        # Latest request profiles of every worker, see start_profile
+        self.profiles = ProfileStore()
+
+        # Served requests for gostop_replay.py when CAPTURE_DIR is set
+        self.request_log = RequestLog()
+
+        # Every mutation of a league goes through that league's single writer
+        self.writers = {}
+        self.writers_lock = threading.Lock()
+
+        # Periodic snapshots when BACKUP_DIR and BACKUP_INTERVAL are set
+        start_backup_scheduler()
+
         self.register_hooks()
         self.register_routes()
 
+    def _prepare_database(self, league, gostop_db):
+        """
+        Keep older databases up to date with the schema, every statement is idempotent
+        """
+        with self.prepare_lock:
+            if league in self.prepared:
+                return
+
+            gostop_db.create_database()
+            gostop_db._backfill_daily_rollups()
+            if gostop_db._ratings_missing():
+                self._replay_ratings(0, gostop_db)
+                gostop_db.db_con.commit()
+
+            self.prepared.add(league)
+
     def get_db(self):
         if "gostop_db" not in g:
-            g.gostop_db = GostopDB()
+            league = g.get("league")
+            g.gostop_db = GostopDB(league=league)
+            if league not in self.prepared:
+                self._prepare_database(league, g.gostop_db)
         return g.gostop_db
 
+    def get_writer(self):
+        """
+        Get the writer of the request's league
+        """
+        league = g.get("league")
+        with self.writers_lock:
+            writer = self.writers.get(league)
+            if writer is None:
+                writer = GostopWriter(league)
+                self.writers[league] = writer
+
+        return writer
+
+    def resolve_league(self):
+        """
+        Pick the league of the request from the URL prefix or the access token
+        """
+        league = request.environ.get("gostop.league")
+        claims = token_claims()
+
+        # A token is bound to the league it was issued for, None being the default league, so a
+        # default league token opens no /leagues/<league> URL
+        if claims is not None:
+            from_token = claims.get("league")
+            if league is None:
+                league = from_token
+            elif from_token != league:
+                return jsonify({"message": "Token is for another league"}), 403
+
+        if league is not None and not league_exists(league):
+            return jsonify({"error": f"Unknown league {league}"}), 404
+
+        g.league = league
+
     def close_db(self, e=None):
         db = g.pop("gostop_db", None)
         if db is not None:
             db.close()
 
+    def _get_cached(self, key, gostop_db, build):
+        """
+        Get a derived value for the current data version, building it on a miss
+        """
+        league = g.get("league")
+        version = gostop_db._get_data_version()
+
+        cache = self.version_caches.pop(league, None)
+        if cache is None or cache["version"] != version or len(cache["entries"]) >= 64:
+            cache = {"version": version, "entries": {}}
+
+        self.version_caches[league] = cache
+        while len(self.version_caches) > MAX_OPEN_LEAGUES:
+            self.version_caches.popitem(last=False)
+
+        value = cache["entries"].get(key)
+        if value is None:
+            value = build()
+            cache["entries"][key] = value
+
+        return value
+
+    def start_capture(self):
+        """
+        Note when the request started while requests are being captured
+        """
+        if self.request_log.enabled:
+            g.capture_started_at = time.time()
+            g.capture_start = time.perf_counter()
+
+    def finish_capture(self, response):
+        """
+        Record the request for replay, the timing covers everything but compression
+        """
+        start = g.pop("capture_start", None)
+        if start is None:
+            return response
+
+        self.request_log.record(
+            g.capture_started_at,
+            time.perf_counter() - start,
+            request.environ.get("gostop.league"),
+            request.method,
+            request.url_rule.rule if request.url_rule is not None else None,
+            request.path,
+            list(request.args.items(multi=True)),
+            request.get_json(silent=True) if request.is_json else None,
+            token_claims() is not None,
+            response.status_code,
+        )
+
+        return response
+
+    def compress_response(self, response):
+        """
+        Compress large bodies for clients that accept it. The compressed body is cached by the
+        digest of the plain one, so a body is compressed once for as long as it stays the same
+        """
+        if not compressible(response):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        response.set_data(self.compressed.compress(response.get_data(), encoding))
+        response.headers["Content-Encoding"] = encoding
+
+        return response
+
+    def start_profile(self):
+        """
+        Profile the request when an admin sends X-Profile or it is sampled
+        """
+        if request.headers.get("X-Profile") is not None:
+            claims = token_claims()
+            wanted = claims is not None and is_admin(claims)
+        else:
+            wanted = sampled()
+
+        if wanted:
+            g.profile_start = time.perf_counter()
+            g.profiler = start_request_profiler()
+
+    def stop_profile(self, response):
+        """
+        Store the request's profile, the client gets its id back in X-Profile-Id
+        """
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return response
+
+        # Writes ran on the writer thread, their profiles are merged in here
+        stats = stop_request_profiler(profiler)
+        seconds = time.perf_counter() - g.profile_start
+        profile_id = self.profiles.add(stats, g.get("league"), request.method, request.full_path.rstrip("?"),
+                                       response.status_code, seconds)
+        response.headers["X-Profile-Id"] = profile_id
+
+        return response
+
+    def writer_busy(self, e):
+        resp = jsonify({"error": str(e)})
+        resp.headers["Retry-After"] = "1"
+        return resp, 503
+
+    def write_timeout(self, e):
+        # The write may still commit, no Retry-After so clients do not repeat it
+        return jsonify({"error": str(e)}), 504
+
+    def game_archived(self, e):
+        return jsonify({"error": str(e)}), 409
+
     def register_hooks(self):
+        # The profiler is started first and stopped last so it covers every other hook
+        self.app.before_request(self.start_profile)
+        self.app.before_request(self.start_capture)
+        self.app.before_request(self.resolve_league)
         self.app.teardown_appcontext(self.close_db)
+        # after_request hooks run in reverse, the capture is finished before the body is
+        # compressed since replays are sent without Accept-Encoding
+        self.app.after_request(self.stop_profile)
+        self.app.after_request(self.compress_response)
+        self.app.after_request(self.finish_capture)
+        self.app.register_error_handler(WriterBusy, self.writer_busy)
+        self.app.register_error_handler(WriteTimeout, self.write_timeout)
+        self.app.register_error_handler(GameArchived, self.game_archived)
 
     def _update_point_balances(self, game_data, player_data):
         """
@@ -121,9 +462,10 @@ class GostopFlask():
 
     def _update_frl_balances(self, game_data, player_data):
         """
-        Update the point deltas from the first round lock event, subtract 5 points from all players
-        that arent a seller and add them to the first round lock players totals
+        Update the point deltas from the first round lock event, subtract the FRL points from all
+        players that arent a seller and add them to the first round lock players totals
         """
+        frl_points = STANDARD_RULES.frl_points
         for row in game_data:
             if row.get("event_type") == "FIRST_ROUND_LOCK":
                 lock_player = row.get("player_id")
@@ -138,8 +480,8 @@ class GostopFlask():
                         continue
 
                     # Always 0 sum
-                    player["point_delta"] -= 5
-                    player_data[lock_player_idx]["point_delta"] += 5
+                    player["point_delta"] -= frl_points
+                    player_data[lock_player_idx]["point_delta"] += frl_points
         
     def _update_seller_balances(self, game_data, player_data):
         """
@@ -199,12 +541,14 @@ class GostopFlask():
 
     def _clear_deltas_and_balances(self, gostop_db):
         """
-        Clear all the balances and point deltas from the database
+        Clear all the balances and point deltas from the database, balances restart from the
+        archived games which are never recalculated
         """
+        archived = gostop_db._get_archived_balances()
         players = gostop_db._get_player()
         if players is not None:
             for player in players:
-                gostop_db._update_player_balance(player.get("id"), 0)
+                gostop_db._update_player_balance(player.get("id"), archived.get(player.get("id"), 0))
 
         roles = gostop_db._get_role()
         if roles is not None:
@@ -224,6 +568,187 @@ class GostopFlask():
             gostop_db._update_player_balance(points["player_id"], new_balance)
             gostop_db._update_role_point_delta(points["role_id"], 0)
 
+    def _build_head_to_head(self, gostop_db):
+        """
+        Build the head to head matrices from the pairwise rows, players without shared games get 0
+        """
+        players = gostop_db._get_player() or []
+        players.sort(key=lambda p: p.get("id"))
+        index = {p.get("id"): idx for idx, p in enumerate(players)}
+
+        size = len(players)
+        games_together = [[0] * size for _ in range(size)]
+        wins = [[0] * size for _ in range(size)]
+        net_points = [[0] * size for _ in range(size)]
+
+        for row in gostop_db._get_head_to_head() or []:
+            i = index.get(row["player_id"])
+            j = index.get(row["opponent_id"])
+            if i is None or j is None:
+                continue
+
+            games_together[i][j] = row["games_together"]
+            wins[i][j] = row["wins"]
+            net_points[i][j] = row["net_points"]
+
+        return {
+            "players": [{"id": p.get("id"), "name": p.get("name")} for p in players],
+            "games_together": games_together,
+            "wins": wins,
+            "net_points": net_points,
+        }
+
+    def _parse_stats_range(self):
+        """
+        Parse the from and to query args into a UTC [start, end) range, a bare to date includes
+        the whole day. Returns None when neither is given
+        """
+        range_from = request.args.get("from")
+        range_to = request.args.get("to")
+        if range_from is None and range_to is None:
+            return None
+
+        start = datetime.min
+        if range_from:
+            start = parse_utc(range_from)
+
+        end = RANGE_MAX
+        if range_to:
+            end = parse_utc(range_to)
+            if len(range_to) == 10 and end < RANGE_MAX:
+                end += timedelta(days=1)
+
+        # Day arithmetic past the last representable day overflows, no game is that late anyway
+        start = min(start, RANGE_MAX)
+        end = min(end, RANGE_MAX)
+
+        return start, max(start, end)
+
+    def _parse_fields(self, columns):
+        """
+        Parse the comma separated fields query arg, None when every column is wanted
+        """
+        fields = request.args.get("fields")
+        if fields is None:
+            return None
+
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in fields if f not in columns]
+        if unknown or not fields:
+            raise ValueError(f"fields must be some of {', '.join(columns)}")
+
+        return fields
+
+    def _game_edit_layout(self, game_id, game):
+        """
+        Shape a game from _get_games_for_edit like the new game form submits it
+        """
+        resp_dict = {"playing": [], "gameId": game_id, "dealer": None, "seller": {}, "winner": {}}
+        resp_dict["winner"]["id"] = game.get("winner_id")
+        players = game.get("players", [])
+
+        for player in players:
+            if player.get("role") == "DEALER":
+                resp_dict["dealer"] = player.get("id")
+
+            if player.get("role") == "SELLER":
+                resp_dict["seller"]["id"] = player.get("id")
+                for event in player.get("points_events", []):
+                    if event.get("event_type") == "SELL":
+                        resp_dict["seller"]["points"] = event.get("points", 0)
+                        break
+
+            if player.get("id") == game.get("winner_id"):
+                for event in player.get("points_events", []):
+                    if event.get("event_type") == "WIN":
+                        resp_dict["winner"]["points"] = event.get("points", 0)
+                        break
+
+            player_entry = {"id": player.get("id"), "frl": False, "multiplier": 1}
+            for event in player.get("points_events", []):
+                if event.get("event_type") == "FIRST_ROUND_LOCK":
+                    player_entry["frl"] = True
+                elif event.get("event_type") == "LOSS_MULTIPLIER":
+                    player_entry["multiplier"] = event.get("points", 1)
+
+            resp_dict["playing"].append(player_entry)
+
+        return resp_dict
+
+    def _get_range_stats(self, gostop_db, start, end, fields=None):
+        """
+        Get the stats response for the games created in [start, end)
+        """
+        resp_dict = {}
+
+        deal_win_per = gostop_db._get_win_deal_data_range(start, end)
+        if deal_win_per is None or deal_win_per.get("dealer_win_percentage") is None:
+            resp_dict["dealer_win_percentage"] = 0
+        else:
+            resp_dict["dealer_win_percentage"] = deal_win_per.get("dealer_win_percentage")
+
+        player_games = gostop_db._get_player_stats_range(start, end, fields)
+        if player_games is None:
+            resp_dict["players"] = []
+        else:
+            resp_dict["players"] = player_games
+
+        return resp_dict
+
+    def _replay_ratings(self, from_game_id, gostop_db):
+        """
+        Rewind the ratings to before from_game_id and re-rate every game from there on, a new
+        game only re-rates itself so this costs O(players in game) for inserts
+        """
+        gostop_db._rewind_ratings(from_game_id)
+
+        games = {}
+        for row in gostop_db._get_rating_games(from_game_id):
+            games.setdefault(row.get("game_id"), []).append(row)
+
+        ratings = {}
+        for game_id, roles in games.items():
+            winner_id = roles[0].get("winner_id")
+            participants = game_participants(roles, winner_id)
+
+            missing = [player_id for player_id in participants if player_id not in ratings]
+            if missing:
+                for player_id in missing:
+                    ratings[player_id] = (INITIAL_RATING, 0)
+                for row in gostop_db._get_ratings(missing):
+                    ratings[row.get("player_id")] = (row.get("rating"), row.get("games"))
+
+            before = {player_id: ratings[player_id] for player_id in participants}
+            new_ratings = rate_game({player_id: rating for player_id, (rating, _) in before.items()},
+                                    winner_id, participants)
+            if not new_ratings:
+                continue
+
+            after = {player_id: (new_ratings[player_id], before[player_id][1] + 1) for player_id in participants}
+            ratings.update(after)
+            gostop_db._save_game_ratings(game_id, before, after)
+
+    def _simulate(self, rules, gostop_db):
+        """
+        Replay the whole history under a rule set in memory and compare against the real balances
+        """
+        rows, player_ids = build_scoring_rows(gostop_db._get_scoring_roles(), gostop_db._get_scoring_events())
+        simulated = dict(zip(player_ids.tolist(), rules.balances(rows, len(player_ids)).tolist()))
+
+        players = []
+        for player in gostop_db._get_player() or []:
+            balance = simulated.get(player.get("id"), 0)
+            players.append({
+                "id": player.get("id"),
+                "name": player.get("name"),
+                "balance": balance,
+                "actual_balance": player.get("balance"),
+                "difference": balance - player.get("balance"),
+            })
+
+        players.sort(key=lambda p: p.get("balance"), reverse=True)
+        return {"rules": rules.to_dict(), "players": players}
+
     def register_routes(self):
         @self.app.route("/refresh", methods=["POST"])
         def refresh():
@@ -238,6 +763,7 @@ class GostopFlask():
             try:
                 data = jwt.decode(token, REFRESH_SECRET_KEY, algorithms=[ALGORITHM])
                 username = data['username']
+                league = data.get('league')
             except jwt.ExpiredSignatureError:
                 return jsonify({"message": "Refresh token has expired"}), 401
             except Exception as e:
@@ -245,7 +771,7 @@ class GostopFlask():
                 return jsonify({"message": "Invalid refresh token"}), 401
 
             # Generate new tokens
-            access_token, refresh_token = generate_tokens(username)
+            access_token, refresh_token = generate_tokens(username, league)
 
             response = jsonify({ "access_token": access_token })
             response.set_cookie("refresh_token", refresh_token, httponly=False, secure=False, samesite="Lax")
@@ -264,13 +790,46 @@ class GostopFlask():
             if not bcrypt.checkpw(auth.get("password").encode('utf-8'), PASSWORD):
                 return jsonify({"message": "Invalid password"}), 401
 
-            access_token, refresh_token = generate_tokens(auth.get("username"))
+            access_token, refresh_token = generate_tokens(auth.get("username"), g.league)
 
             response = jsonify({ "access_token": access_token })
             response.set_cookie("refresh_token", refresh_token, httponly=False, secure=False, samesite="Lax")
 
             return response, 200
 
+        @self.app.route("/leagues", methods=["GET"])
+        @token_required
+        def get_leagues():
+            """
+            Get the ids of the leagues with their own database
+            """
+            return jsonify(list_leagues()), 200
+
+        @self.app.route("/leagues", methods=["POST"])
+        @token_required
+        def add_league():
+            """
+            Create the database of a new league
+            """
+            data = request.get_json(silent=True) or {}
+            league = data.get("league")
+            if LEAGUE_DIR is None:
+                return jsonify({"error": "LEAGUE_DIR is not configured"}), 400
+
+            if not isinstance(league, str) or not LEAGUE_PATTERN.match(league):
+                return jsonify({"error": "league must be lowercase letters, digits, - and _"}), 400
+
+            if league_exists(league):
+                return jsonify({"error": "League exists"}), 409
+
+            os.makedirs(LEAGUE_DIR, exist_ok=True)
+            gostop_db = GostopDB(league=league, pooled=False)
+            self.prepared.discard(league)
+            self._prepare_database(league, gostop_db)
+            gostop_db.close()
+
+            return jsonify({"league": league}), 201
+
         @self.app.route("/stats", methods=["GET"])
         def get_stats():
             """
@@ -279,13 +838,26 @@ class GostopFlask():
             gostop_db = self.get_db()
             resp_dict = {}
 
+            try:
+                stats_range = self._parse_stats_range()
+            except ValueError:
+                return jsonify({"error": "from and to must be ISO dates or datetimes"}), 400
+
+            try:
+                fields = self._parse_fields(STATS_FIELDS if stats_range is None else RANGE_STATS_FIELDS)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            if stats_range is not None:
+                return jsonify(self._get_range_stats(gostop_db, *stats_range, fields)), 200
+
             deal_win_per = gostop_db._get_win_deal_data()
             if deal_win_per is None:
                 resp_dict["dealer_win_percentage"] = 0
             else:
                 resp_dict["dealer_win_percentage"] = deal_win_per.get("dealer_win_percentage")
 
-            player_games = gostop_db._get_player_stats()
+            player_games = gostop_db._get_player_stats(fields)
             if player_games is None:
                 resp_dict["players"] = []
             else:
@@ -293,6 +865,42 @@ class GostopFlask():
 
             return jsonify(resp_dict), 200
 
+        @self.app.route("/stats/head_to_head", methods=["GET"])
+        def get_head_to_head():
+            """
+            Get N x N matrices of games played together, wins over each other and net points
+            transferred, row i column j is from the point of view of player i against player j
+            """
+            gostop_db = self.get_db()
+            return jsonify(self._get_cached("head_to_head", gostop_db,
+                    lambda: self._build_head_to_head(gostop_db))), 200
+
+        @self.app.route("/simulate/rules", methods=["GET"])
+        def get_rule_sets():
+            """
+            Get the preset rule sets that can be simulated
+            """
+            return jsonify({name: rules.to_dict() for name, rules in RULE_SETS.items()}), 200
+
+        @self.app.route("/simulate", methods=["POST"])
+        @token_required
+        def simulate():
+            """
+            Get the balances every player would have under an alternate rule set, nothing is stored
+            """
+            gostop_db = self.get_db()
+            data = request.get_json(silent=True) or {}
+
+            try:
+                rules = RuleSet.from_dict(data.get("rules", "standard"))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            result = self._get_cached(("simulate", rules.key()), gostop_db,
+                    lambda: self._simulate(rules, gostop_db))
+
+            return jsonify(result), 200
+
         @self.app.route("/player.svg", methods=["GET"])
         def get_player_svg():
             """
@@ -300,42 +908,33 @@ class GostopFlask():
             and normalize game IDs so there are no gaps in the x-axis.
             """
             gostop_db = self.get_db()
-            player_data = gostop_db._get_player_over_time()
-            df = pd.DataFrame(player_data)
 
-            # Sort globally by game_id
-            df = df.sort_values("game_id").reset_index(drop=True)
+            def build():
+                columns = gostop_db._get_player_over_time()
+                names = gostop_db._get_player_names()
 
-            # Create a mapping from actual game_id to a normalized sequential ID
-            unique_game_ids = df["game_id"].unique()
-            id_mapping = {old_id: new_id for new_id, old_id in enumerate(unique_game_ids, start=0)}
+                # A figure of its own rather than pyplot's global one, requests render on many threads
+                fig = Figure(figsize=(15, 10))
+                ax = fig.add_subplot()
 
-            # Apply mapping
-            df["normalized_game_id"] = df["game_id"].map(id_mapping)
+                # Cumulative sum of points over the normalized game ids, one line per player
+                for player_id, game_index, cumulative_points in player_cumulative(columns):
+                    ax.plot(game_index, cumulative_points, markersize=4, marker="o", label=names.get(player_id))
 
-            plt.figure(figsize=(15, 10))
+                ax.set_title("Player Points Over Time")
+                ax.set_xlabel("Game")
+                ax.set_ylabel("Cumulative Points")
+                ax.legend()
+                ax.grid(True)
 
-            for player_id, group in df.groupby("player_id"):
-                group = group.sort_values("normalized_game_id")
-                player_name = group["player_name"].unique()[0]
+                # Save to in-memory SVG
+                svg_io = io.StringIO()
+                fig.savefig(svg_io, format="svg", bbox_inches="tight")
 
-                # Cumulative sum of points
-                group["cumulative_points"] = group["point_delta"].cumsum()
+                return svg_io.getvalue()
 
-                plt.plot(group["normalized_game_id"], group["cumulative_points"], markersize=4, marker="o", label=player_name)
-
-            plt.title("Player Points Over Time")
-            plt.xlabel("Game")
-            plt.ylabel("Cumulative Points")
-            plt.legend()
-            plt.grid(True)
-
-            # Save to in-memory SVG
-            svg_io = io.StringIO()
-            plt.savefig(svg_io, format="svg", bbox_inches="tight")
-            plt.close()
-
-            svg_bytes = svg_io.getvalue()
+            # Rendered once per data version so the compressed body is reused as well
+            svg_bytes = self._get_cached(("player.svg", ), gostop_db, build)
             resp = make_response(svg_bytes)
             resp.headers["Content-Type"] = "image/svg+xml"
             resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
@@ -344,6 +943,22 @@ class GostopFlask():
 
             return resp
 
+        @self.app.route("/players/timeseries", methods=["GET"])
+        def get_player_timeseries():
+            """
+            Get every players cumulative points over time, downsampled to at most points samples
+            per player so the payload stays bounded no matter how long the history is
+            """
+            points = request.args.get("points", DEFAULT_POINTS, type=int)
+            points = max(MIN_POINTS, min(points, MAX_POINTS))
+
+            gostop_db = self.get_db()
+            series = self._get_cached(("timeseries", points), gostop_db,
+                    lambda: build_player_timeseries(gostop_db._get_player_over_time(),
+                                                    gostop_db._get_player_names(), points))
+
+            return jsonify(series), 200
+
         @self.app.route("/num_games", methods=["GET"])
         def get_num_game():
             """
@@ -357,16 +972,132 @@ class GostopFlask():
 
             return jsonify(res), 200
 
+        def check_consistency(full=False, save=False):
+            """
+            Check the point deltas and balances changed since the last check add up, with save the
+            result is stored by the writer so the next check starts from here
+            """
+            start = time.perf_counter()
+
+            gostop_db = self.get_db()
+            result = gostop_db._check_consistency(full)
+            if save:
+                self.get_writer().submit(lambda writer_db: writer_db._save_consistency(result))
+
+            # Violations are a finding of the check, not a server error
+            return jsonify(consistency_report(result, time.perf_counter() - start)), 200
+
+        @self.app.route("/health/consistency", methods=["GET"])
+        def get_consistency():
+            """
+            Read-only consistency check of what changed since the last stored check, ?full=1
+            rechecks everything and needs a token
+            """
+            if request.args.get("full") in ("1", "true"):
+                return token_required(check_consistency)(True)
+
+            return check_consistency()
+
+        @self.app.route("/health/consistency", methods=["POST"])
+        @token_required
+        def save_consistency():
+            """
+            Run the consistency check and store its violations and watermark, ?full=1 rechecks everything
+            """
+            return check_consistency(request.args.get("full") in ("1", "true"), save=True)
+
+        @self.app.route("/profiles", methods=["GET"])
+        @admin_required
+        def get_profiles():
+            """
+            List the league's request profiles kept by every worker, newest first
+            """
+            return jsonify(self.profiles.list(g.league)), 200
+
+        @self.app.route("/profiles/<profile_id>", methods=["GET"])
+        @admin_required
+        def get_profile(profile_id):
+            """
+            Download a request profile as a pstats file or, with ?format=collapsed, as collapsed
+            stacks for flamegraph.pl and speedscope
+            """
+            profile = self.profiles.get(profile_id, g.league)
+            if profile is None:
+                return jsonify({"error": "Profile not found"}), 404
+
+            fmt = request.args.get("format", "pstats")
+            if fmt == "pstats":
+                resp = make_response(to_pstats(profile["stats"]))
+                resp.headers["Content-Type"] = "application/octet-stream"
+                resp.headers["Content-Disposition"] = f"attachment; filename=profile-{profile_id}.prof"
+            elif fmt == "collapsed":
+                resp = make_response(to_collapsed(profile["stats"]))
+                resp.headers["Content-Type"] = "text/plain; charset=utf-8"
+            else:
+                return jsonify({"error": "format must be pstats or collapsed"}), 400
+
+            return resp
+
+        @self.app.route("/leaderboard", methods=["GET"])
+        def get_leaderboard():
+            """
+            Get the top players by balance and the total number of games for the home page
+            """
+            try:
+                top = min(max(int(request.args.get("top", LEADERBOARD_TOP)), 1), MAX_LEADERBOARD_TOP)
+            except ValueError:
+                return jsonify({"error": "top must be an integer"}), 400
+
+            gostop_db = self.get_db()
+            num_game = gostop_db._get_num_games()
+
+            return jsonify({
+                "total_games": num_game[0].get("total_games") if num_game is not None else 0,
+                "players": gostop_db._get_leaderboard(top),
+            }), 200
+
+        @self.app.route("/league", methods=["GET"])
+        def get_league():
+            """
+            Get the league settings, clients can localize created_ts epochs with the timezone
+            """
+            gostop_db = self.get_db()
+            return jsonify({"timezone": gostop_db._get_league_timezone()}), 200
+
+        @self.app.route("/league", methods=["PATCH"])
+        @token_required
+        def update_league():
+            """
+            Change the timezone game times are shown in
+            """
+            data = request.get_json(silent=True) or {}
+            tz_name = data.get("timezone")
+            if not isinstance(tz_name, str) or not valid_timezone(tz_name):
+                return jsonify({"error": "timezone must be an IANA timezone name"}), 400
+
+            self.get_writer().submit(lambda gostop_db: gostop_db._set_league_timezone(tz_name))
+            return jsonify({"timezone": tz_name}), 200
+
         @self.app.route("/games/<int:game_id>", methods=["DELETE"])
         @token_required
         def delete_game(game_id):
             """
             Delete a game from the database
             """
-            gostop_db = self.get_db()
-            self._undo_game_balances(game_id, gostop_db)
+            def write(gostop_db):
+                gostop_db._check_game_writable(game_id)
+
+                game = gostop_db._get_game(game_id)
+                self._undo_game_balances(game_id, gostop_db)
+
+                gostop_db._delete_game(game_id)
 
-            gostop_db._delete_game(game_id)
+                if game is not None:
+                    day = game[0].get("created_at")[:10]
+                    gostop_db._refresh_daily_rollups(day, day)
+                    self._replay_ratings(game_id, gostop_db)
+
+            self.get_writer().submit(write)
             return "", 200
 
         @self.app.route("/update", methods=["PATCH"])
@@ -375,23 +1106,52 @@ class GostopFlask():
             """
             0 out all the balances and point deltas for all players and recalculate everything
             """
-            gostop_db = self.get_db()
-            self._clear_deltas_and_balances(gostop_db)
+            def write(gostop_db):
+                self._clear_deltas_and_balances(gostop_db)
+
+                games = gostop_db._get_game()
+                if games is not None:
+                    for game in games:
+                        self._update_balances(game.get("id"), gostop_db)
+
+                gostop_db._refresh_daily_rollups()
 
-            games = gostop_db._get_game()
-            if games is not None:
-                for game in games:
-                    self._update_balances(game.get("id"), gostop_db)
+                gostop_db._clear_ratings()
+                self._replay_ratings(0, gostop_db)
 
+            self.get_writer().submit(write)
             return jsonify(""), 200
 
+        def get_games_by_id():
+            """
+            Get many games at once, in the same shape as a single game and in the order asked for
+            """
+            try:
+                game_ids = [int(i) for i in request.args.get("ids").split(",") if i.strip()]
+            except ValueError:
+                return jsonify({"error": "ids must be a comma separated list of game ids"}), 400
+
+            gostop_db = self.get_db()
+            games = gostop_db._get_games_for_edit(game_ids)
+
+            return jsonify([self._game_edit_layout(i, games[i]) for i in dict.fromkeys(game_ids) if i in games]), 200
+
         @self.app.route("/games", methods=["GET"])
         def get_games():
             """
             Get a nice display struct with all the games in it
             """
+            if "ids" in request.args:
+                return token_required(get_games_by_id)()
+
             gostop_db = self.get_db()
-            games = gostop_db._get_games_layout()
+
+            try:
+                fields = self._parse_fields(GAME_FIELDS)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            games = gostop_db._get_games_layout(fields=fields)
             if games is None:
                 return jsonify([])
 
@@ -409,39 +1169,7 @@ class GostopFlask():
             if game is None:
                 return jsonify([]), 404
 
-            game = game[0]
-
-            resp_dict = {"playing": [], "gameId": game_id, "dealer": None, "seller": {}, "winner": {}}
-            resp_dict["winner"]["id"] = game.get("winner_id")
-            players = game.get("players", [])
-
-            for player in players:
-                if player.get("role") == "DEALER":
-                    resp_dict["dealer"] = player.get("id")
-
-                if player.get("role") == "SELLER":
-                    resp_dict["seller"]["id"] = player.get("id")
-                    for event in player.get("points_events", []):
-                        if event.get("event_type") == "SELL":
-                            resp_dict["seller"]["points"] = event.get("points", 0)
-                            break
-
-                if player.get("id") == game.get("winner_id"):
-                    for event in player.get("points_events", []):
-                        if event.get("event_type") == "WIN":
-                            resp_dict["winner"]["points"] = event.get("points", 0)
-                            break
-
-                player_entry = {"id": player.get("id"), "frl": False, "multiplier": 1}
-                for event in player.get("points_events", []):
-                    if event.get("event_type") == "FIRST_ROUND_LOCK":
-                        player_entry["frl"] = True
-                    elif event.get("event_type") == "LOSS_MULTIPLIER":
-                        player_entry["multiplier"] = event.get("points", 1)
-
-                resp_dict["playing"].append(player_entry)
-
-            return jsonify(resp_dict), 200
+            return jsonify(self._game_edit_layout(game_id, game[0])), 200
 
         @self.app.route("/games/new_game", methods=["POST"])
         @token_required
@@ -472,41 +1200,64 @@ class GostopFlask():
             if players is None:
                 return jsonify({"error": "Players are required"}), 400
 
-            # If this an edit game, remove all the game data and re-add it
-            game_id = data.get("gameId")
-            if game_id is not None:
-                # Undo the balances from the previous game
-                self._undo_game_balances(game_id, gostop_db)
-                gostop_db._delete_game_data(game_id)
+            def write(writer_db):
+                # If this an edit game, remove all the game data and re-add it
+                game_id = data.get("gameId")
+                if game_id is not None:
+                    writer_db._check_game_writable(game_id)
+                    if writer_db._get_game(game_id) is None:
+                        return None
 
-                gostop_db._update_game_winner(game_id, winner_id)
-            else:
-                game_id = gostop_db._insert_new_game(winner_id)
+                    # Undo the balances from the previous game
+                    self._undo_game_balances(game_id, writer_db)
+                    writer_db._delete_game_data(game_id)
 
-            for player in players:
-                id = player.get("id")
-                multiplier = player.get("multiplier", 1)
-                frl = player.get("frl", False)
+                    writer_db._update_game_winner(game_id, winner_id)
+                else:
+                    game_id = writer_db._insert_new_game(winner_id)
 
-                role = "PLAYER"
-                if id == dealer_id: role = "DEALER"
-                elif id == seller_id: role = "SELLER"
+                for player in players:
+                    id = player.get("id")
+                    multiplier = player.get("multiplier", 1)
+                    frl = player.get("frl", False)
 
-                # Insert the new role
-                role_id = gostop_db._insert_new_role(game_id, id, role)
+                    role = "PLAYER"
+                    if id == dealer_id: role = "DEALER"
+                    elif id == seller_id: role = "SELLER"
 
-                if frl:
-                    gostop_db._insert_new_points_event(role_id, "FIRST_ROUND_LOCK", 5)
+                    # Insert the new role
+                    role_id = writer_db._insert_new_role(game_id, id, role)
 
-                if id == winner_id:
-                    gostop_db._insert_new_points_event(role_id, "WIN", winner_points)
-                elif id == seller_id:
-                    gostop_db._insert_new_points_event(role_id, "SELL", seller_points)
-                else:
-                    gostop_db._insert_new_points_event(role_id, "LOSS_MULTIPLIER", multiplier)
+                    if frl:
+                        writer_db._insert_new_points_event(role_id, "FIRST_ROUND_LOCK", STANDARD_RULES.frl_points)
+
+                    if id == winner_id:
+                        writer_db._insert_new_points_event(role_id, "WIN", winner_points)
+                    elif id == seller_id:
+                        writer_db._insert_new_points_event(role_id, "SELL", seller_points)
+                    else:
+                        writer_db._insert_new_points_event(role_id, "LOSS_MULTIPLIER", multiplier)
 
-            # Update all the game balances
-            self._update_balances(game_id, gostop_db)
+                # Update all the game balances
+                self._update_balances(game_id, writer_db)
+
+                game = writer_db._get_game(game_id)
+                day = game[0].get("created_at")[:10]
+                writer_db._refresh_daily_rollups(day, day)
+                self._replay_ratings(game_id, writer_db)
+
+                return game_id
+
+            try:
+                game_id = self.get_writer().submit(write)
+            except sqlite3.IntegrityError as e:
+                # Foreign keys are enforced on the writer, a role or winner of an unknown player
+                if "FOREIGN KEY" not in str(e):
+                    raise
+                return jsonify({"error": "Unknown player"}), 400
+
+            if game_id is None:
+                return jsonify({"error": f"Game {data.get('gameId')} not found"}), 404
 
             game_display_data = gostop_db._get_games_layout(game_id)
             if game_display_data is None:
@@ -526,10 +1277,17 @@ class GostopFlask():
         @token_required
         def update_player(player_id):
             gostop_db = self.get_db()
-            data = request.get_json()
-            name = data.get("name")
-            username = data.get("username")
-            gostop_db._set_player_name(player_id, name, username)
+            try:
+                name, username = parse_player_names(request.get_json(silent=True) or {})
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            try:
+                self.get_writer().submit(lambda writer_db: writer_db._set_player_name(player_id, name, username))
+            except sqlite3.IntegrityError as e:
+                if not username_taken(e):
+                    raise
+                return jsonify({"error": "Username taken"}), 409
 
             player = gostop_db._get_player(id=player_id)
             if player is None:
@@ -540,29 +1298,48 @@ class GostopFlask():
         @self.app.route("/players", methods=["GET"])
         def get_players():
             gostop_db = self.get_db()
-            players = gostop_db._get_player()
+
+            try:
+                fields = self._parse_fields(PLAYER_FIELDS)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            players = gostop_db._get_player(fields=fields)
             if players is None:
                 return jsonify([]), 200
 
             return jsonify(players), 200
 
+        @self.app.route("/players/search", methods=["GET"])
+        def search_players():
+            """
+            Autocomplete players by name or username, only id and name are sent back
+            """
+            query = request.args.get("q", "")
+            try:
+                limit = min(max(int(request.args.get("limit", SEARCH_LIMIT)), 1), MAX_SEARCH_LIMIT)
+            except ValueError:
+                return jsonify({"error": "limit must be an integer"}), 400
+
+            gostop_db = self.get_db()
+            return jsonify(gostop_db._search_players(query, limit)), 200
+
         @self.app.route("/players", methods=["POST"])
         @token_required
         def add_player():
             gostop_db = self.get_db()
-            data = request.get_json()
-            name = data.get("name").strip()
-            username = data.get("username").strip()
-            if not name or not username:
-                return jsonify({"error": "Player name is required"}), 400
+            try:
+                name, username = parse_player_names(request.get_json(silent=True) or {})
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
 
-            # Check to see if player already exists
-            player = gostop_db._get_player(username=username)
-            if player is not None:
+            # The unique index on username turns a taken username into an IntegrityError
+            try:
+                player_id = self.get_writer().submit(lambda writer_db: writer_db._insert_new_player(name, username))
+            except sqlite3.IntegrityError as e:
+                if not username_taken(e):
+                    raise
                 return jsonify({"error": "Username taken"}), 409
-            
-            # insert as new player
-            player_id = gostop_db._insert_new_player(name, username)
 
             # get players data and return it to the gui
             player = gostop_db._get_player(id=player_id)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import json
+import re
+import secrets
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+# orjson 3.9 and later embed already encoded JSON natively through Fragment
+FRAGMENT = getattr(orjson, "Fragment", None)
+
+# Otherwise raw JSON is dumped as this placeholder string first and spliced in afterwards, the
+# random token keeps any stored string from ever matching it
+RAW_TOKEN = "\x00" + secrets.token_hex(8) + ":"
+RAW_PATTERN = re.compile(rb'"\\u0000' + RAW_TOKEN[1:].encode() + rb'(\d+)"')
+
+class RawJSON():
+    """
+    Text that is already valid JSON, such as a json_group_array built by SQLite, and is written
+    into responses as is instead of being parsed and encoded again
+    """
+    __slots__ = ("text", )
+
+    def __init__(self, text):
+        self.text = text
+
+def dumps_bytes(obj, indent=False, default=None):
+    """
+    Encode obj as UTF-8 JSON with RawJSON values passed through, default encodes any other type
+    neither encoder knows
+    """
+    raws = []
+
+    def encode(o):
+        if isinstance(o, RawJSON):
+            if FRAGMENT is not None:
+                return FRAGMENT(o.text)
+
+            raws.append(o.text.encode() if isinstance(o.text, str) else o.text)
+            return f"{RAW_TOKEN}{len(raws) - 1}"
+
+        if default is None:
+            raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+        return default(o)
+
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        out = orjson.dumps(obj, default=encode, option=option)
+    else:
+        out = json.dumps(obj, default=encode, ensure_ascii=False,
+                         indent=2 if indent else None,
+                         separators=None if indent else (",", ":")).encode()
+
+    if raws:
+        out = RAW_PATTERN.sub(lambda m: raws[int(m.group(1))], out)
+
+    return out
+
+def loads(s):
+    """
+    Decode JSON text or bytes
+    """
+    if orjson is not None:
+        return orjson.loads(s)
+
+    return json.loads(s)
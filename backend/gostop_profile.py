@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+import cProfile
+import json
+import marshal
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+# Fraction of all requests profiled without being asked to, 0 only profiles on request
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Profiles are files in this directory so every gunicorn worker serves all of them
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "gostop-profiles"))
+# Profiles kept across all workers, the oldest is dropped first
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "32"))
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Deepest call stack written to the collapsed stacks and the least time a stack needs to be
+# written on its own, deeper and shorter calls are folded into their parent
+MAX_STACK_DEPTH = 128
+MIN_STACK_SECONDS = 1e-5
+
+def sampled():
+    """
+    Check whether a request should be profiled by the sampling rate
+    """
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def start_profiler():
+    """
+    Start a cProfile profiler on the current thread, None when another profiler is already running
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+
+    return profiler
+
+# Writer profiles of the writes the current thread's profiled request submitted
+COLLECTED = threading.local()
+
+def start_request_profiler():
+    """
+    Start profiling the current thread's request, writes it submits are profiled on the writer
+    thread and collected for it
+    """
+    profiler = start_profiler()
+    if profiler is not None:
+        COLLECTED.profilers = []
+
+    return profiler
+
+def collecting():
+    """
+    Check whether the current thread's request is profiled
+    """
+    return getattr(COLLECTED, "profilers", None) is not None
+
+def collect(profiler):
+    """
+    Add a stopped profiler from another thread to the current thread's request profile
+    """
+    profilers = getattr(COLLECTED, "profilers", None)
+    if profilers is not None:
+        profilers.append(profiler)
+
+def stop_request_profiler(profiler):
+    """
+    Stop the request profiler and merge in the writer profiles it collected, returns the stats
+    """
+    profiler.disable()
+    profilers = getattr(COLLECTED, "profilers", None) or []
+    COLLECTED.profilers = None
+
+    stats = pstats.Stats(profiler)
+    for other in profilers:
+        stats.add(other)
+
+    return stats.stats
+
+class ProfileStore():
+    """
+    The latest request profiles of every worker as files in a shared directory, ids are random
+    so workers never hand out the same one
+    """
+
+    def __init__(self, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+
+    def add(self, stats, league, method, path, status, seconds):
+        """
+        Store profile stats with what they profiled and drop the oldest profiles, returns its id
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        profile_id = uuid.uuid4().hex
+        meta = {
+            "id": profile_id,
+            "league": league,
+            "pid": os.getpid(),
+            "method": method,
+            "path": path,
+            "status": status,
+            "seconds": round(seconds, 6),
+            "created_at": time.time(),
+        }
+
+        # The stats go first and the metadata last, a profile is listed only once it is complete
+        base = os.path.join(self.directory, profile_id)
+        for ext, data in ((".prof", to_pstats(stats)), (".json", json.dumps(meta).encode())):
+            with open(base + ext + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(base + ext + ".tmp", base + ext)
+
+        self._prune()
+        return profile_id
+
+    def _metas(self):
+        metas = []
+        if not os.path.isdir(self.directory):
+            return metas
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+
+            # Another worker may prune it while it is read
+            try:
+                with open(os.path.join(self.directory, name), "r") as f:
+                    metas.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+        metas.sort(key=lambda m: m["created_at"], reverse=True)
+        return metas
+
+    def _prune(self):
+        for meta in self._metas()[self.keep:]:
+            for ext in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(self.directory, meta["id"] + ext))
+                except OSError:
+                    pass
+
+    def list(self, league=None):
+        """
+        Get every stored profile of a league without its stats, newest first
+        """
+        return [m for m in self._metas() if m.get("league") == league]
+
+    def get(self, profile_id, league=None):
+        """
+        Get a stored profile of a league by id with its stats, None once it has been dropped
+        """
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+
+        base = os.path.join(self.directory, profile_id)
+        try:
+            with open(base + ".json", "r") as f:
+                meta = json.load(f)
+            with open(base + ".prof", "rb") as f:
+                meta["stats"] = marshal.load(f)
+        except (OSError, ValueError, EOFError):
+            return None
+
+        if meta.get("league") != league:
+            return None
+
+        return meta
+
+def to_pstats(stats):
+    """
+    Serialize profile stats in the file format pstats.Stats and snakeviz load
+    """
+    return marshal.dumps(stats)
+
+def frame_label(func):
+    filename, lineno, name = func
+    if filename == "~":
+        return name.replace(";", ",")
+
+    return f"{name} ({os.path.basename(filename)}:{lineno})".replace(";", ",")
+
+def to_collapsed(stats):
+    """
+    Convert profile stats into flamegraph.pl collapsed stacks in microseconds. cProfile only keeps
+    caller and callee pairs, so a function's time is split over the stacks it was reached by in
+    proportion to the time each caller spent in it, share is the part of func's time on stack
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, ct) in callers.items():
+            callees.setdefault(caller, []).append((func, ct))
+
+    lines = {}
+
+    def walk(func, stack, share):
+        stack = stack + [frame_label(func)]
+        own = stats[func][2] * share
+
+        for callee, edge_ct in callees.get(func, ()):
+            callee_ct = stats[callee][3]
+            if callee_ct <= 0 or edge_ct <= 0:
+                continue
+
+            # Recursive calls are already inside the outer call's time
+            if frame_label(callee) in stack:
+                continue
+
+            if len(stack) >= MAX_STACK_DEPTH or edge_ct * share < MIN_STACK_SECONDS:
+                own += edge_ct * share
+                continue
+
+            walk(callee, stack, min(edge_ct * share / callee_ct, 1.0))
+
+        key = ";".join(stack)
+        lines[key] = lines.get(key, 0) + own
+
+    roots = [func for func, (_, _, _, _, callers) in stats.items() if not callers]
+    for root in roots:
+        walk(root, [], 1.0)
+
+    return "".join(f"{stack} {round(seconds * 1e6)}\n" for stack, seconds in lines.items()
+                   if round(seconds * 1e6) > 0)
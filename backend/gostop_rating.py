@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+
+def expected_score(rating, opponent_rating):
+    """
+    Probability that a player with rating beats a player with opponent_rating
+    """
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / 400.0))
+
+def game_participants(roles, winner_id):
+    """
+    Get the players that actually played the hand, a seller sits out unless they still won
+    """
+    return [r.get("player_id") for r in roles if r.get("role") != "SELLER" or r.get("player_id") == winner_id]
+
+def rate_game(ratings, winner_id, player_ids):
+    """
+    Get the new ratings of everyone in a game, the winner beat every other participant and the
+    K factor is split across those pairings so a game is worth the same no matter the table size
+    """
+    if winner_id not in player_ids or len(player_ids) < 2:
+        return {}
+
+    k = K_FACTOR / (len(player_ids) - 1)
+    new_ratings = {player_id: ratings[player_id] for player_id in player_ids}
+
+    for player_id in player_ids:
+        if player_id == winner_id:
+            continue
+
+        delta = k * (1.0 - expected_score(ratings[winner_id], ratings[player_id]))
+        new_ratings[winner_id] += delta
+        new_ratings[player_id] -= delta
+
+    return new_ratings
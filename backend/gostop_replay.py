@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import importlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+# Access tokens live for a minute, log in again a little before that
+TOKEN_SECONDS = 50
+
+PERCENTILES = (50, 95, 99)
+
+def load_requests(paths):
+    """
+    Read captured request logs, every worker's file merged in start time order
+    """
+    records = []
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            with open(path, "r") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+
+    records.sort(key=lambda r: r["t"])
+    return records
+
+def copy_snapshot(src, dst):
+    """
+    Copy a database with the backup API so a snapshot taken from a live WAL file is consistent
+    """
+    src_con = sqlite3.connect(f"file:{src}?mode=ro", uri=True)
+    dst_con = sqlite3.connect(dst)
+    try:
+        src_con.backup(dst_con)
+    finally:
+        dst_con.close()
+        src_con.close()
+
+def prepare_snapshot(snapshot, league_dir, work_dir):
+    """
+    Copy the snapshot, its archive and the league databases into work_dir so the replayed writes
+    never touch the originals, returns the DATABASE_PATH and LEAGUE_DIR to run against
+    """
+    db_path = os.path.join(work_dir, "gostop.db")
+    copy_snapshot(snapshot, db_path)
+
+    root, ext = os.path.splitext(snapshot)
+    if os.path.exists(root + ".archive" + (ext or ".db")):
+        copy_snapshot(root + ".archive" + (ext or ".db"), os.path.join(work_dir, "gostop.archive.db"))
+
+    leagues_path = os.path.join(work_dir, "leagues")
+    os.makedirs(leagues_path)
+    if league_dir:
+        for path in glob.glob(os.path.join(league_dir, "*.db")):
+            copy_snapshot(path, os.path.join(leagues_path, os.path.basename(path)))
+
+    return db_path, leagues_path
+
+def summarize(latencies):
+    """
+    Get the count and millisecond percentiles of every route's latencies
+    """
+    summary = {}
+    for route, seconds in sorted(latencies.items()):
+        ms = np.array(seconds) * 1000
+        summary[route] = {"count": len(ms), "mean": round(float(ms.mean()), 3), "max": round(float(ms.max()), 3)}
+        for p in PERCENTILES:
+            summary[route][f"p{p}"] = round(float(np.percentile(ms, p)), 3)
+
+    return summary
+
+def replay(records, code_dir, snapshot, league_dir=None, speedup=0.0, password=None):
+    """
+    Replay captured requests in order against a copy of snapshot with the backend in code_dir,
+    keeping the original gaps between requests divided by speedup, 0 sends them back to back.
+    Returns the latencies per route and how many responses differ in status from the capture
+    """
+    work_dir = tempfile.mkdtemp(prefix="gostop-replay-")
+    db_path, leagues_path = prepare_snapshot(snapshot, league_dir, work_dir)
+
+    # The backend reads its settings on import, nothing of the replay itself may be captured
+    os.environ["DATABASE_PATH"] = db_path
+    os.environ["LEAGUE_DIR"] = leagues_path
+    for name in ("CAPTURE_DIR", "BACKUP_DIR", "PROFILE_SAMPLE_RATE"):
+        os.environ.pop(name, None)
+    if password is not None:
+        os.environ["PASSWORD"] = password
+
+    sys.path.insert(0, os.path.abspath(code_dir))
+    gostop_flask = importlib.import_module("gostop_flask")
+    client = gostop_flask.app.test_client()
+
+    # Tokens are bound to the league they were issued for, so each league gets its own
+    tokens = {}
+
+    def auth_headers(league):
+        token = tokens.get(league)
+        if token is None or time.monotonic() - token["at"] > TOKEN_SECONDS:
+            prefix = f"/leagues/{league}" if league else ""
+            resp = client.post(prefix + "/login", json={"username": "replay", "password": os.getenv("PASSWORD", "admin1234")})
+            if resp.status_code != 200:
+                raise RuntimeError("Replay login failed, pass the password of the snapshot's server")
+            token = {"value": resp.get_json()["access_token"], "at": time.monotonic()}
+            tokens[league] = token
+
+        return {"Authorization": "Bearer " + token["value"]}
+
+    latencies = {}
+    mismatches = {}
+
+    start = time.perf_counter()
+    first = records[0]["t"] if records else 0.0
+    for rec in records:
+        if speedup > 0:
+            delay = (rec["t"] - first) / speedup - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        url = (f"/leagues/{rec['league']}" if rec.get("league") else "") + rec["path"]
+        headers = auth_headers(rec.get("league")) if rec.get("auth") else {}
+        kwargs = {"json": rec["body"]} if rec.get("body") is not None else {}
+
+        begin = time.perf_counter()
+        resp = client.open(url, method=rec["method"], query_string=rec.get("args") or None, headers=headers, **kwargs)
+        resp.get_data()
+        elapsed = time.perf_counter() - begin
+
+        route = f"{rec['method']} {rec.get('route') or rec['path']}"
+        latencies.setdefault(route, []).append(elapsed)
+        if resp.status_code != rec.get("status"):
+            mismatches[route] = mismatches.get(route, 0) + 1
+
+    return {
+        "code": os.path.abspath(code_dir),
+        "snapshot": os.path.abspath(snapshot),
+        "speedup": speedup,
+        "requests": len(records),
+        "seconds": round(time.perf_counter() - start, 4),
+        "status_mismatches": mismatches,
+        "routes": summarize(latencies),
+    }
+
+def compare(base, head, threshold=None):
+    """
+    Compare the per route latencies of two replays of the same capture, returns the report rows
+    and the routes whose p50 got slower by more than threshold percent
+    """
+    rows = []
+    regressions = []
+    for route in sorted(set(base["routes"]) | set(head["routes"])):
+        a = base["routes"].get(route)
+        b = head["routes"].get(route)
+        row = {"route": route, "count": (b or a)["count"]}
+        for p in ("p50", "p95"):
+            row[p] = (a[p] if a else None, b[p] if b else None)
+            row[p + "_change"] = round(100.0 * (b[p] - a[p]) / a[p], 1) if a and b and a[p] > 0 else None
+
+        if threshold is not None and row["p50_change"] is not None and row["p50_change"] > threshold:
+            regressions.append(route)
+        rows.append(row)
+
+    return rows, regressions
+
+def print_comparison(rows):
+    width = max([len(r["route"]) for r in rows] + [5])
+    print(f"{'route':<{width}} {'count':>6} {'p50 base':>10} {'p50 head':>10} {'change':>8} {'p95 base':>10} {'p95 head':>10} {'change':>8}")
+
+    def cell(value, suffix=""):
+        return "-" if value is None else f"{value}{suffix}"
+
+    for r in rows:
+        print(f"{r['route']:<{width}} {r['count']:>6} "
+              f"{cell(r['p50'][0]):>10} {cell(r['p50'][1]):>10} {cell(r['p50_change'], '%'):>8} "
+              f"{cell(r['p95'][0]):>10} {cell(r['p95'][1]):>10} {cell(r['p95_change'], '%'):>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured requests and compare latencies between code versions")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="replay captured requests against a snapshot")
+    run_parser.add_argument("logs", nargs="+", help="requests-*.jsonl files written with CAPTURE_DIR set")
+    run_parser.add_argument("--snapshot", required=True, help="database snapshot to replay against, it is copied first")
+    run_parser.add_argument("--league-dir", default=None, help="league databases to copy alongside the snapshot")
+    run_parser.add_argument("--code", default=os.path.dirname(os.path.abspath(__file__)),
+                            help="backend directory of the code version to run")
+    run_parser.add_argument("--speedup", type=float, default=0.0,
+                            help="divide the captured gaps between requests by this, 0 sends them back to back")
+    run_parser.add_argument("--password", default=None, help="login password of the snapshot's server")
+    run_parser.add_argument("--out", default=None, help="write the results here as JSON")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two replay results")
+    compare_parser.add_argument("base", help="results of the reference code version")
+    compare_parser.add_argument("head", help="results of the changed code version")
+    compare_parser.add_argument("--threshold", type=float, default=None,
+                                help="exit with 1 when a route's p50 got slower by more than this percent")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        result = replay(load_requests(args.logs), args.code, args.snapshot, args.league_dir,
+                        args.speedup, args.password)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(result, f, indent=2)
+        print(json.dumps(result, indent=2))
+    elif args.command == "compare":
+        with open(args.base, "r") as f:
+            base = json.load(f)
+        with open(args.head, "r") as f:
+            head = json.load(f)
+
+        rows, regressions = compare(base, head, args.threshold)
+        print_comparison(rows)
+        if regressions:
+            print("Slower:", ", ".join(regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+# Role codes used by the scoring rows
+ROLE_PLAYER = 0
+ROLE_DEALER = 1
+ROLE_SELLER = 2
+
+# Columns of the scoring rows, one row per role
+COL_GAME = 0
+COL_PLAYER = 1
+COL_ROLE = 2
+COL_FRL = 3
+COL_WINNER = 4
+COL_WIN = 5
+COL_SELLER = 6
+COL_SELL = 7
+COL_LOSER = 8
+COL_MULTIPLIER = 9
+
+# Event codes of the scoring events and the flag, points columns they fill in
+EVENT_COLUMNS = {
+    0: (COL_FRL, None),
+    1: (COL_WINNER, COL_WIN),
+    2: (COL_SELLER, COL_SELL),
+    3: (COL_LOSER, COL_MULTIPLIER),
+}
+
+def build_scoring_rows(roles, events):
+    """
+    Join the (role id, game id, player id, role code) roles and (role id, event code, points)
+    events into one scoring row per role, compacting game and player ids. Returns the rows and
+    the player id of every compacted player index
+    """
+    roles = np.asarray(roles, dtype=np.int64).reshape(-1, 4)
+    events = np.asarray(events, dtype=np.int64).reshape(-1, 3)
+
+    rows = np.zeros((len(roles), 10), dtype=np.int64)
+    if len(roles) == 0:
+        return rows, np.zeros(0, dtype=np.int64)
+
+    roles = roles[np.argsort(roles[:, 0])]
+    _, rows[:, COL_GAME] = np.unique(roles[:, 1], return_inverse=True)
+    player_ids, rows[:, COL_PLAYER] = np.unique(roles[:, 2], return_inverse=True)
+    rows[:, COL_ROLE] = roles[:, 3]
+
+    # Events of roles that are not part of a stored game are dropped
+    idx = np.searchsorted(roles[:, 0], events[:, 0])
+    idx[idx == len(roles)] = 0
+    matched = roles[idx, 0] == events[:, 0]
+
+    for code, (flag_col, points_col) in EVENT_COLUMNS.items():
+        mask = matched & (events[:, 1] == code)
+        rows[idx[mask], flag_col] = 1
+        if points_col is not None:
+            rows[idx[mask], points_col] = events[mask, 2]
+
+    return rows, player_ids
+
+class RuleSet():
+    """
+    A scoring variant, the defaults are the rules the league actually plays with
+    """
+
+    OPTIONS = {
+        "frl_points": int,
+        "multiply_sell": bool,
+        "use_multipliers": bool,
+        "pay_sells": bool,
+    }
+
+    def __init__(self, frl_points=5, multiply_sell=True, use_multipliers=True, pay_sells=True):
+        # Points every non seller pays a first round locker
+        self.frl_points = frl_points
+        # Losers pay (win + sell) * multiplier instead of win * multiplier + sell
+        self.multiply_sell = multiply_sell
+        # Honor the loss multipliers, otherwise every loser pays as if it was 1
+        self.use_multipliers = use_multipliers
+        # Non dealers pay the seller the sell points before the hand
+        self.pay_sells = pay_sells
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build a rule set from a preset name or a dict of options on top of an optional "base" preset
+        """
+        if isinstance(data, str):
+            data = {"base": data}
+
+        if not isinstance(data, dict):
+            raise ValueError("rules must be a preset name or an object")
+
+        data = dict(data)
+        base = data.pop("base", "standard")
+        if base not in RULE_SETS:
+            raise ValueError(f"Unknown rule set {base}")
+
+        options = RULE_SETS[base].to_dict()
+        for key, value in data.items():
+            option_type = cls.OPTIONS.get(key)
+            if option_type is None:
+                raise ValueError(f"Unknown rule {key}")
+
+            if type(value) is not option_type:
+                raise ValueError(f"Rule {key} must be a {option_type.__name__}")
+
+            options[key] = value
+
+        return cls(**options)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.OPTIONS}
+
+    def key(self):
+        return tuple(sorted(self.to_dict().items()))
+
+    def score(self, rows):
+        """
+        Get the point delta of every role in one vectorized pass over the scoring rows, an
+        (n, 10) integer array in any order with the game and player columns already compacted
+        to 0..games-1 and 0..players-1
+        """
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        game = rows[:, COL_GAME]
+        role = rows[:, COL_ROLE]
+        frl = rows[:, COL_FRL]
+        is_winner = rows[:, COL_WINNER] > 0
+        win = rows[:, COL_WIN]
+        is_seller = rows[:, COL_SELLER] > 0
+        sell = rows[:, COL_SELL]
+        is_loser = rows[:, COL_LOSER] > 0
+        multiplier = rows[:, COL_MULTIPLIER] if self.use_multipliers else is_loser.astype(np.int64)
+
+        num_games = int(game.max()) + 1
+        def per_game(values):
+            return np.bincount(game, weights=values, minlength=num_games).astype(np.int64)
+
+        non_seller = role != ROLE_SELLER
+        sell_payer = (role == ROLE_PLAYER)
+
+        game_win = per_game(win)
+        game_sell = per_game(sell) if self.pay_sells else np.zeros(num_games, dtype=np.int64)
+        game_has_win = per_game(is_winner) > 0
+
+        deltas = np.zeros(len(rows), dtype=np.int64)
+
+        # Sells, every plain player pays the seller
+        if self.pay_sells:
+            paid = np.where(sell_payer, game_sell[game], 0)
+            deltas -= paid
+            deltas += np.where(is_seller, per_game(paid)[game], 0)
+
+        # First round locks, every non seller pays every other locker
+        if self.frl_points:
+            lockers = per_game(frl)
+            non_sellers = per_game(non_seller)
+            deltas -= np.where(non_seller, (lockers[game] - frl) * self.frl_points, 0)
+            deltas += np.where(frl > 0, (non_sellers[game] - non_seller) * self.frl_points, 0)
+
+        # Losses, every non seller loser pays the winner
+        sell_addition = game_sell[game]
+        if self.multiply_sell:
+            loss = (game_win[game] + sell_addition) * multiplier
+        else:
+            loss = game_win[game] * multiplier + np.where(is_loser, sell_addition, 0)
+
+        loss = np.where(is_loser & non_seller & game_has_win[game], loss, 0)
+        deltas -= loss
+        deltas += np.where(is_winner, per_game(loss)[game], 0)
+
+        return deltas
+
+    def balances(self, rows, num_players):
+        """
+        Get the balance of every compacted player id under this rule set
+        """
+        deltas = self.score(rows)
+        if len(deltas) == 0:
+            return np.zeros(num_players, dtype=np.int64)
+
+        return np.bincount(rows[:, COL_PLAYER], weights=deltas, minlength=num_players).astype(np.int64)
+
+RULE_SETS = {
+    "standard": RuleSet(),
+    "no_sell_multiplier": RuleSet(multiply_sell=False),
+    "no_multipliers": RuleSet(use_multipliers=False),
+    "no_frl": RuleSet(frl_points=0),
+    "no_sells": RuleSet(pay_sells=False),
+}
+
+STANDARD_RULES = RULE_SETS["standard"]
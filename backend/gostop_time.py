@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import os
+
+import numpy as np
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+# Timezone a new league database starts with, each league can change its own afterwards
+DEFAULT_TIMEZONE = os.getenv("LEAGUE_TIMEZONE", "America/New_York")
+
+DAY_SECONDS = 86400
+
+def utc_offsets(epochs, tz):
+    """
+    Get the UTC offset in seconds of every epoch in tz, the zone is only asked about the start
+    and end of each distinct UTC day instead of once per epoch
+    """
+    days, inverse = np.unique(epochs // DAY_SECONDS, return_inverse=True)
+
+    def offset(epoch):
+        return int(datetime.fromtimestamp(int(epoch), tz).utcoffset().total_seconds())
+
+    start = np.array([offset(d * DAY_SECONDS) for d in days], dtype=np.int64)
+    end = np.array([offset((d + 1) * DAY_SECONDS - 1) for d in days], dtype=np.int64)
+    offsets = start[inverse]
+
+    # Only the rare days with a transition in them need the exact offset of each epoch
+    changed = np.flatnonzero(start != end)
+    for i in np.flatnonzero(np.isin(inverse, changed)):
+        offsets[i] = offset(epochs[i])
+
+    return offsets
+
+def localize_epochs(epochs, tz_name):
+    """
+    Format UTC epoch seconds as local "YYYY-MM-DD HH:MM:SS" strings in tz_name in one
+    vectorized pass, None epochs stay None
+    """
+    if len(epochs) == 0:
+        return []
+
+    # Pre-1970 times are negative epochs, so missing ones get their own mask instead of a sentinel
+    missing = np.array([e is None for e in epochs], dtype=bool)
+    epochs = np.array([0 if e is None else e for e in epochs], dtype=np.int64)
+
+    local = epochs + utc_offsets(epochs, ZoneInfo(tz_name))
+    strings = np.datetime_as_string(local.astype("datetime64[s]"), unit="s")
+    strings = np.char.replace(strings, "T", " ").astype(object)
+    strings[missing] = None
+
+    return strings.tolist()
+
+def valid_timezone(tz_name):
+    """
+    Check tz_name is a timezone the zone database knows about
+    """
+    try:
+        ZoneInfo(tz_name)
+    except (ValueError, KeyError, OSError):
+        return False
+
+    return True
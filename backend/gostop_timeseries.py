@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+DEFAULT_POINTS = 200
+MAX_POINTS = 2000
+MIN_POINTS = 3
+
+def lttb(x, y, points):
+    """
+    Downsample a series to a fixed number of points with Largest-Triangle-Three-Buckets
+
+    The first and last points are always kept, every bucket in between keeps the point that
+    makes the largest triangle with the previously kept point and the next bucket's average
+    """
+    n = len(x)
+    if points >= n or points < MIN_POINTS:
+        return x, y
+
+    # Bucket boundaries for everything except the first and last point
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    starts = edges[:-1]
+    ends = edges[1:]
+
+    # Averages of every bucket, the last bucket looks ahead to the final point
+    sums_x = np.add.reduceat(x[1:n - 1], starts - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], starts - 1)
+    counts = ends - starts
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    keep = np.empty(points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    a = 0
+    for bucket, (start, end) in enumerate(zip(starts, ends)):
+        bx = x[start:end]
+        by = y[start:end]
+
+        # Twice the triangle area, the constant factor does not matter for argmax
+        area = np.abs((x[a] - avg_x[bucket + 1]) * (by - y[a])
+                      - (x[a] - bx) * (avg_y[bucket + 1] - y[a]))
+
+        a = start + int(np.argmax(area))
+        keep[bucket + 1] = a
+
+    return x[keep], y[keep]
+
+def player_cumulative(columns):
+    """
+    Split the player over time columns into per player cumulative point series, yields the
+    player id, the gapless game index and the running total of every player in player id order.
+    Games are normalized to a gapless index the same way for the svg and the timeseries
+    """
+    player_ids = columns["player_id"]
+    if len(player_ids) == 0:
+        return
+
+    _, normalized = np.unique(columns["game_id"], return_inverse=True)
+
+    # Group rows by player and game, then cumsum within every player group
+    order = np.lexsort((normalized, player_ids))
+    player_ids = player_ids[order]
+    normalized = normalized[order]
+    cumulative = np.cumsum(columns["point_delta"][order])
+
+    group_starts = np.flatnonzero(np.r_[True, player_ids[1:] != player_ids[:-1]])
+    group_ends = np.r_[group_starts[1:], len(player_ids)]
+
+    for start, end in zip(group_starts, group_ends):
+        offset = cumulative[start - 1] if start > 0 else 0
+        yield int(player_ids[start]), normalized[start:end], cumulative[start:end] - offset
+
+def build_player_timeseries(columns, names, points):
+    """
+    Build per player cumulative point series from the player over time columns, downsampled to
+    at most points samples per player
+    """
+    if len(columns["game_id"]) == 0:
+        return {"num_games": 0, "players": []}
+
+    players = []
+    for player_id, series_x, series_y in player_cumulative(columns):
+        series_x, series_y = lttb(series_x.astype(np.float64), series_y.astype(np.float64), points)
+
+        players.append({
+            "player_id": player_id,
+            "player_name": names.get(player_id),
+            "x": series_x.astype(np.int64).tolist(),
+            "y": series_y.astype(np.int64).tolist(),
+        })
+
+    return {"num_games": len(np.unique(columns["game_id"])), "players": players}
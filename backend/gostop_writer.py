@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import os
+import queue
+import threading
+
+from gostop_database import GostopDB
+from gostop_profile import collect, collecting, start_profiler
+
+# =============================================================================
+# Globals.
+# =============================================================================
+
+# Pending writes allowed before callers are turned away with a 503
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", "64"))
+# Most writes folded into a single transaction
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "32"))
+# Seconds a caller waits for a queue slot and then for its commit
+WRITE_QUEUE_WAIT = float(os.getenv("WRITE_QUEUE_WAIT", "2"))
+WRITE_TIMEOUT = float(os.getenv("WRITE_TIMEOUT", "30"))
+# Seconds without writes before the writer thread closes its connection and exits
+WRITE_IDLE_SECONDS = float(os.getenv("WRITE_IDLE_SECONDS", "300"))
+
+class WriterBusy(Exception):
+    """
+    The write queue is full or the write did not commit in time
+    """
+
+class WriteTimeout(Exception):
+    """
+    The write started but did not commit in time, it may still commit so it must not be retried
+    """
+
+class WriteJob():
+
+    def __init__(self, fn, profile=False):
+        self.fn = fn
+        self.result = None
+        self.error = None
+        # Profiled requests get the time their write spent on the writer thread
+        self.profile = profile
+        self.profiler = None
+        self.done = threading.Event()
+        # queued -> running, or queued -> cancelled when the caller gave up first
+        self.state = "queued"
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Claim the job for the writer, False when the caller already cancelled it
+        """
+        with self.lock:
+            if self.state == "cancelled":
+                return False
+
+            self.state = "running"
+            return True
+
+    def cancel(self):
+        """
+        Cancel the job if the writer has not picked it up yet, False when it is already running
+        """
+        with self.lock:
+            if self.state == "queued":
+                self.state = "cancelled"
+
+            return self.state == "cancelled"
+
+class GostopWriter():
+    """
+    Single writer for a league database, every mutation runs on one dedicated connection and
+    all writes pending at the same time share one transaction and one commit (group commit)
+    """
+
+    def __init__(self, league=None, max_queue=WRITE_QUEUE_SIZE, max_batch=WRITE_BATCH_SIZE,
+                 idle_seconds=WRITE_IDLE_SECONDS):
+        self.league = league
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.max_batch = max_batch
+        self.idle_seconds = idle_seconds
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _ensure_started(self):
+        """
+        Start the writer thread on first use so it is created after gunicorn forks the worker,
+        and again after it exited for being idle
+        """
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def submit(self, fn):
+        """
+        Run fn(gostop_db) on the writer and return its result once the shared commit is done,
+        exceptions raised by fn are re-raised here and only roll back that one write
+        """
+        job = WriteJob(fn, profile=collecting())
+        try:
+            self.jobs.put(job, timeout=WRITE_QUEUE_WAIT)
+        except queue.Full:
+            raise WriterBusy("Too many pending writes")
+
+        self._ensure_started()
+
+        if not job.done.wait(WRITE_TIMEOUT):
+            # A cancelled job never runs so the caller may safely retry, a running one may still commit
+            if job.cancel():
+                raise WriterBusy("Write did not start in time")
+            if not job.done.is_set():
+                raise WriteTimeout("Write did not commit in time")
+
+        if job.profiler is not None:
+            collect(job.profiler)
+
+        if job.error is not None:
+            raise job.error
+
+        return job.result
+
+    def _run(self):
+        # Other workers may hold the lock, wait for it rather than failing with database is locked
+        gostop_db = GostopDB(timeout=WRITE_TIMEOUT, league=self.league, pooled=False)
+        # Deleting a game takes its roles and points events with it through ON DELETE CASCADE
+        gostop_db.db_con.execute("PRAGMA foreign_keys = ON")
+
+        while True:
+            try:
+                batch = [self.jobs.get(timeout=self.idle_seconds)]
+            except queue.Empty:
+                # Exit only while holding the lock with nothing queued, a submit that raced
+                # in starts a fresh thread once the lock is released
+                with self.lock:
+                    if self.jobs.empty():
+                        self.thread = None
+                        gostop_db.close()
+                        return
+
+                continue
+
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._run_batch(gostop_db, batch)
+
+    def _run_batch(self, gostop_db, batch):
+        """
+        Run every job in one transaction, each inside its own savepoint
+        """
+        db_con = gostop_db.db_con
+        gostop_db.in_batch = True
+
+        try:
+            # Pick up an archive created since the last batch, ATTACH is not allowed in a transaction
+            gostop_db._attach_archive()
+            db_con.execute("BEGIN IMMEDIATE")
+
+            for job in batch:
+                if not job.start():
+                    continue
+
+                db_con.execute("SAVEPOINT write_job")
+                profiler = start_profiler() if job.profile else None
+                try:
+                    job.result = job.fn(gostop_db)
+                    db_con.execute("RELEASE write_job")
+                except Exception as e:
+                    db_con.execute("ROLLBACK TO write_job")
+                    db_con.execute("RELEASE write_job")
+                    job.error = e
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                        job.profiler = profiler
+
+            db_con.commit()
+        except Exception as e:
+            if db_con.in_transaction:
+                db_con.rollback()
+
+            for job in batch:
+                if job.error is None:
+                    job.result = None
+                    job.error = e
+        finally:
+            gostop_db.in_batch = False
+            for job in batch:
+                job.done.set()
@@ -6,6 +6,9 @@ docker build -t gostop_backend .
 # Run the docker container
 docker run -d \
 	-e DATABASE_PATH="/data/.data.DEFAULT.db" \
+	-e LEAGUE_DIR="/data/leagues" \
+	-e BACKUP_DIR="/data/backups" \
+	-e BACKUP_INTERVAL=3600 \
         -e DD_SERVICE=gostop_backend \
 	-e DD_ENV=tdub_aws \
 	-e DD_LOGS_INJECTION=true \
@@ -1,5 +1,8 @@
 PRAGMA foreign_keys = ON;
 
+-- Readers, including online backups, never block the writer
+PRAGMA journal_mode = WAL;
+
 CREATE TABLE IF NOT EXISTS players (
     id INTEGER PRIMARY KEY AUTOINCREMENT, 
     balance INTEGER NOT NULL,
@@ -33,3 +36,176 @@ CREATE TABLE IF NOT EXISTS points_events (
     points INTEGER NOT NULL,
     FOREIGN KEY (role_id) REFERENCES roles(id) ON DELETE CASCADE
 );
+
+
+CREATE INDEX IF NOT EXISTS roles_game_id ON roles(game_id);
+CREATE INDEX IF NOT EXISTS roles_player_id ON roles(player_id);
+CREATE INDEX IF NOT EXISTS points_events_role_id ON points_events(role_id);
+CREATE INDEX IF NOT EXISTS games_created_at ON games(created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS players_username ON players(username);
+CREATE INDEX IF NOT EXISTS players_balance ON players(balance DESC, id);
+
+-- Word prefix index of player names and usernames for the search box, rowid is the player id
+CREATE VIRTUAL TABLE IF NOT EXISTS players_search USING fts5(
+    name,
+    username,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '1 2'
+);
+
+INSERT INTO players_search(rowid, name, username)
+SELECT id, name, username FROM players WHERE id NOT IN (SELECT rowid FROM players_search);
+
+CREATE TRIGGER IF NOT EXISTS players_insert_search AFTER INSERT ON players
+BEGIN INSERT INTO players_search(rowid, name, username) VALUES (NEW.id, NEW.name, NEW.username); END;
+CREATE TRIGGER IF NOT EXISTS players_update_search AFTER UPDATE OF name, username ON players
+BEGIN UPDATE players_search SET name = NEW.name, username = NEW.username WHERE rowid = NEW.id; END;
+CREATE TRIGGER IF NOT EXISTS players_delete_search AFTER DELETE ON players
+BEGIN DELETE FROM players_search WHERE rowid = OLD.id; END;
+
+-- Per player totals for every UTC day, recomputed for the touched day on every game write
+CREATE TABLE IF NOT EXISTS player_daily_stats (
+    day text NOT NULL,
+    player_id INTEGER NOT NULL,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    win_points INTEGER NOT NULL,
+    max_win INTEGER,
+    losses INTEGER NOT NULL,
+    loss_points INTEGER NOT NULL,
+    max_loss INTEGER,
+    seller_games INTEGER NOT NULL,
+    sells INTEGER NOT NULL,
+    sell_points INTEGER NOT NULL,
+    max_sell INTEGER,
+    frls INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    dealer_games INTEGER NOT NULL,
+    dealer_wins INTEGER NOT NULL,
+    PRIMARY KEY (day, player_id),
+    FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE
+);
+
+-- Settings of the league this database holds
+CREATE TABLE IF NOT EXISTS league_settings (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    timezone TEXT NOT NULL
+);
+
+-- Number of live games, kept by triggers in the same transaction as the game writes so the
+-- home page never counts the games table
+CREATE TABLE IF NOT EXISTS game_counter (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    games INTEGER NOT NULL
+);
+
+INSERT INTO game_counter(id, games)
+SELECT 1, (SELECT COUNT(*) FROM games) WHERE NOT EXISTS (SELECT 1 FROM game_counter);
+
+CREATE TRIGGER IF NOT EXISTS games_insert_counter AFTER INSERT ON games
+BEGIN UPDATE game_counter SET games = games + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS games_delete_counter AFTER DELETE ON games
+BEGIN UPDATE game_counter SET games = games - 1 WHERE id = 1; END;
+
+-- Bumped by triggers on every write so caches can be keyed on the data version
+CREATE TABLE IF NOT EXISTS data_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO data_version(id, version) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS players_insert_version AFTER INSERT ON players
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS players_update_version AFTER UPDATE ON players
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS players_delete_version AFTER DELETE ON players
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+
+CREATE TRIGGER IF NOT EXISTS games_insert_version AFTER INSERT ON games
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS games_update_version AFTER UPDATE ON games
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS games_delete_version AFTER DELETE ON games
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+
+CREATE TRIGGER IF NOT EXISTS roles_insert_version AFTER INSERT ON roles
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS roles_update_version AFTER UPDATE ON roles
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS roles_delete_version AFTER DELETE ON roles
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+
+CREATE TRIGGER IF NOT EXISTS points_events_insert_version AFTER INSERT ON points_events
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS points_events_update_version AFTER UPDATE ON points_events
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS points_events_delete_version AFTER DELETE ON points_events
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+
+-- Cached responses hold game times formatted in the league timezone
+CREATE TRIGGER IF NOT EXISTS league_settings_insert_version AFTER INSERT ON league_settings
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+CREATE TRIGGER IF NOT EXISTS league_settings_update_version AFTER UPDATE ON league_settings
+BEGIN UPDATE data_version SET version = version + 1 WHERE id = 1; END;
+
+-- Current elo rating of every rated player
+CREATE TABLE IF NOT EXISTS player_ratings (
+    player_id INTEGER PRIMARY KEY,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE
+);
+
+-- Rating of every participant right before a game was rated, rewinding to a game restores the
+-- first checkpoint at or after it for every player
+CREATE TABLE IF NOT EXISTS rating_checkpoints (
+    game_id INTEGER NOT NULL,
+    player_id INTEGER NOT NULL,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL,
+    PRIMARY KEY (game_id, player_id),
+    FOREIGN KEY (player_id) REFERENCES players(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS rating_checkpoints_player_id ON rating_checkpoints(player_id, game_id);
+
+-- Every game and player whose deltas or balance changed, appended by triggers so the consistency
+-- checker only looks at what changed since its watermark
+CREATE TABLE IF NOT EXISTS consistency_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id INTEGER,
+    player_id INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS consistency_watermark (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    seq INTEGER NOT NULL,
+    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Open violations, rechecked on every run until they are fixed
+CREATE TABLE IF NOT EXISTS consistency_violations (
+    kind text NOT NULL,
+    entity_id INTEGER NOT NULL,
+    expected INTEGER NOT NULL,
+    actual INTEGER NOT NULL,
+    PRIMARY KEY (kind, entity_id)
+);
+
+CREATE TRIGGER IF NOT EXISTS roles_insert_consistency AFTER INSERT ON roles
+BEGIN INSERT INTO consistency_changes(game_id, player_id) VALUES (NEW.game_id, NEW.player_id); END;
+CREATE TRIGGER IF NOT EXISTS roles_update_consistency AFTER UPDATE OF game_id, player_id, point_delta ON roles
+WHEN OLD.game_id IS NOT NEW.game_id OR OLD.player_id IS NOT NEW.player_id OR OLD.point_delta IS NOT NEW.point_delta
+BEGIN
+    INSERT INTO consistency_changes(game_id, player_id) VALUES (OLD.game_id, OLD.player_id);
+    INSERT INTO consistency_changes(game_id, player_id) VALUES (NEW.game_id, NEW.player_id);
+END;
+CREATE TRIGGER IF NOT EXISTS roles_delete_consistency AFTER DELETE ON roles
+BEGIN INSERT INTO consistency_changes(game_id, player_id) VALUES (OLD.game_id, OLD.player_id); END;
+
+CREATE TRIGGER IF NOT EXISTS players_insert_consistency AFTER INSERT ON players
+BEGIN INSERT INTO consistency_changes(player_id) VALUES (NEW.id); END;
+CREATE TRIGGER IF NOT EXISTS players_balance_consistency AFTER UPDATE OF balance ON players
+WHEN OLD.balance IS NOT NEW.balance
+BEGIN INSERT INTO consistency_changes(player_id) VALUES (NEW.id); END;